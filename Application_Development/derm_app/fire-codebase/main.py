@@ -2,12 +2,255 @@
 # To get started, simply uncomment the below code or create your own.
 # Deploy with `firebase deploy`
 
-from firebase_functions import https_fn
+import concurrent.futures
+import json
+import os
+import struct
+import threading
+import time
+
+import cv2
+import numpy as np
+from firebase_functions import https_fn, options
 from firebase_admin import initialize_app
 
 initialize_app()
+
+# MobileNetV2 lesion classifier, as the model.tflite that
+# Skin-Cancer-Segmentation-master/mainMB.py writes after training. Copy it
+# next to this file before deploying, or point MODEL_FILE at it.
+MODEL_FILE = os.environ.get(
+    "MODEL_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "model.tflite"))
+IMAGE_SIZE = 224
+BATCH_MAX = 32  # images per forward pass in classify_batch, as in training
+# Same order as used during training
+class_names = ["malignant", "seborrheic_keratosis", "benign"]
+
+# Nothing heavy happens at import: the interpreter is built by the first
+# request an instance serves and reused by every request after it.
+interpreter = None
+input_index = output_index = None
+MODEL_LOAD_MS = None  # what the cold request spent loading the model
+model_lock = threading.Lock()  # one invoke at a time per interpreter
+
+
+def load_model():
+    """Build this instance's interpreter if it doesn't have one yet.
+
+    Returns the milliseconds this request spent on it if the interpreter
+    wasn't ready when it arrived (a cold start, whether it did the loading
+    or waited for a concurrent request that did), None once warm.
+    """
+    global interpreter, input_index, output_index, MODEL_LOAD_MS
+    if interpreter is not None:
+        return None
+    t_wait = time.perf_counter()
+    with model_lock:
+        if interpreter is None:
+            t0 = time.perf_counter()
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:  # local runs on a platform without a tflite-runtime wheel
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+            # Given a path (rather than model_content) TFLite mmaps the flatbuffer,
+            # so weights are paged in from the file instead of read and copied
+            interp = Interpreter(model_path=MODEL_FILE)
+            interp.allocate_tensors()
+            input_index = interp.get_input_details()[0]["index"]
+            output_index = interp.get_output_details()[0]["index"]
+            MODEL_LOAD_MS = (time.perf_counter() - t0) * 1000
+            interpreter = interp
+    return (time.perf_counter() - t_wait) * 1000
+
+
+def decode_lesion(data):
+    """Encoded image bytes -> 224x224 BGR uint8, or None if it doesn't decode.
+
+    Decoding and resizing stay in uint8; the float conversion happens once
+    on the final batch.
+    """
+    if not data:
+        return None  # imdecode raises on an empty buffer
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    return cv2.resize(img, (IMAGE_SIZE, IMAGE_SIZE), interpolation=cv2.INTER_AREA)
+
+
+def predict(images):
+    """One forward pass over a list of 224x224 uint8 images.
+
+    The input tensor is only resized when the batch size changes, so runs of
+    single images (or of full BATCH_MAX batches) reuse the allocated tensors.
+    """
+    load_model()
+    with model_lock:
+        if interpreter.get_input_details()[0]["shape"][0] != len(images):
+            interpreter.resize_tensor_input(
+                input_index, [len(images), IMAGE_SIZE, IMAGE_SIZE, 3])
+            interpreter.allocate_tensors()
+        # Scale straight into the interpreter's input buffer
+        batch = interpreter.tensor(input_index)()
+        for j, img in enumerate(images):
+            np.multiply(img, 1 / 255.0, out=batch[j])
+        del batch  # invoke() refuses to run while views of its buffers exist
+        interpreter.invoke()
+        scores = interpreter.get_tensor(output_index)
+    results = []
+    for p in scores:
+        i = int(np.argmax(p))
+        results.append({"label": class_names[i], "confidence": float(p[i]),
+                        "scores": dict(zip(class_names, map(float, p)))})
+    return results
+
+
+def upload_bytes(req):
+    # multipart/form-data with an "image" field, or the raw image as the body
+    if req.files:
+        f = req.files.get("image") or next(iter(req.files.values()))
+        return f.read()
+    return req.get_data()
+
+
+def batch_items(req):
+    """(name, bytes) for every image in a batch upload.
+
+    multipart/form-data: every file field, in order. Anything else: the
+    body is a run of images, each prefixed with its length as a 4-byte
+    big-endian integer.
+    """
+    if req.files:
+        return [(f.filename or key, f.read())
+                for key in req.files for f in req.files.getlist(key)]
+    data = req.get_data()
+    items = []
+    pos = 0
+    while pos < len(data):
+        if pos + 4 > len(data):
+            raise ValueError("truncated length prefix at byte %d" % pos)
+        (n,) = struct.unpack_from(">I", data, pos)
+        pos += 4
+        if pos + n > len(data):
+            raise ValueError("image %d runs past the end of the body" % len(items))
+        items.append((str(len(items)), data[pos:pos + n]))
+        pos += n
+    return items
+
+
+# Decoding is spread over threads (OpenCV releases the GIL); shared by requests
+decoder = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+
+def json_response(body, status=200, timing=None):
+    headers = {}
+    if timing:
+        # Shows up in browser dev tools and is easy to scrape in load tests
+        headers["Server-Timing"] = ", ".join(f"{k};dur={v:.1f}" for k, v in timing.items())
+    return https_fn.Response(json.dumps(body), status=status, headers=headers,
+                             content_type="application/json")
+
+
 #
 #
 @https_fn.on_request()
 def on_request_example(req: https_fn.Request) -> https_fn.Response:
-     return https_fn.Response("Hello world!")
\ No newline at end of file
+     return https_fn.Response("Hello world!")
+
+
+@https_fn.on_request(memory=options.MemoryOption.GB_2)
+def classify(req: https_fn.Request) -> https_fn.Response:
+    """POST a lesion image, get the MobileNetV2 prediction back as JSON.
+
+    Under the emulator (`firebase emulators:start --only functions`):
+        curl -F image=@lesion.jpg \
+            http://127.0.0.1:5001/<project>/us-central1/classify
+    """
+    if req.method != "POST":
+        return json_response({"error": "POST an image"}, status=405)
+    t0 = time.perf_counter()
+    img = decode_lesion(upload_bytes(req))
+    if img is None:
+        return json_response({"error": "could not decode image"}, status=400)
+    t1 = time.perf_counter()
+    load_ms = load_model()
+    t2 = time.perf_counter()
+    result = predict([img])[0]
+    t3 = time.perf_counter()
+    timing = {"decode": (t1 - t0) * 1000, "load": (t2 - t1) * 1000,
+              "infer": (t3 - t2) * 1000, "total": (t3 - t0) * 1000}
+    if load_ms is None:
+        del timing["load"]
+    result["timing_ms"] = {k: round(v, 1) for k, v in timing.items()}
+    result["cold_start"] = load_ms is not None
+    result["model_load_ms"] = round(MODEL_LOAD_MS, 1)
+    return json_response(result, timing=timing)
+
+
+@https_fn.on_request(memory=options.MemoryOption.GB_2)
+def classify_batch(req: https_fn.Request) -> https_fn.Response:
+    """POST many lesion images at once; results stream back as NDJSON.
+
+    Images are decoded in parallel and go through the classifier
+    BATCH_MAX at a time - one forward pass for a typical visit. Each batch's
+    results are written as soon as it finishes, one JSON line per image
+    ({"index", "name", "label", ...} or {"index", "name", "error"}),
+    followed by a summary line with "done" and the timings.
+
+        curl -F image=@a.jpg -F image=@b.jpg \
+            http://127.0.0.1:5001/<project>/us-central1/classify_batch
+    """
+    if req.method != "POST":
+        return json_response({"error": "POST images"}, status=405)
+    t0 = time.perf_counter()
+    try:
+        items = batch_items(req)
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
+    if not items:
+        return json_response({"error": "no images in the request"}, status=400)
+    decoded = [decoder.submit(decode_lesion, data) for _, data in items]
+
+    def stream():
+        # On a cold instance the model loads while the pool decodes
+        t = time.perf_counter()
+        load_ms = load_model()
+        timing = {"decode": 0.0, "infer": 0.0}
+        if load_ms is not None:
+            timing["load"] = (time.perf_counter() - t) * 1000
+        pending = []  # (index, name, image) waiting for a forward pass
+        t = time.perf_counter()
+
+        def flush():
+            t1 = time.perf_counter()
+            results = predict([img for _, _, img in pending])
+            timing["infer"] += (time.perf_counter() - t1) * 1000
+            for (i, name, _), result in zip(pending, results):
+                yield json.dumps({"index": i, "name": name, **result}) + "\n"
+            pending.clear()
+
+        for i, ((name, _), job) in enumerate(zip(items, decoded)):
+            try:
+                img = job.result()
+            except Exception:  # the response has started: report it in-band
+                img = None
+            if img is None:
+                yield json.dumps({"index": i, "name": name,
+                                  "error": "could not decode image"}) + "\n"
+                continue
+            pending.append((i, name, img))
+            if len(pending) == BATCH_MAX:
+                timing["decode"] += (time.perf_counter() - t) * 1000
+                yield from flush()
+                t = time.perf_counter()
+        timing["decode"] += (time.perf_counter() - t) * 1000
+        if pending:
+            yield from flush()
+        timing["total"] = (time.perf_counter() - t0) * 1000
+        yield json.dumps({"done": True, "count": len(items),
+                          "timing_ms": {k: round(v, 1) for k, v in timing.items()},
+                          "cold_start": load_ms is not None,
+                          "model_load_ms": round(MODEL_LOAD_MS, 1)}) + "\n"
+
+    return https_fn.Response(stream(), content_type="application/x-ndjson")
@@ -0,0 +1,161 @@
+"""
+Tests for main.py that need neither Firebase nor a model: firebase_functions,
+firebase_admin and tflite_runtime are replaced by small fakes, the
+interpreter scoring images by their mean brightness.
+
+    python -m pytest test_main.py
+"""
+
+import importlib
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import types
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class Response:
+    def __init__(self, body=None, status=200, headers=None, content_type=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.content_type = content_type
+
+    def lines(self):
+        return [json.loads(line) for line in self.body]
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class FakeInterpreter:
+    loads = 0
+    LOAD_SECONDS = 0.3
+
+    def __init__(self, model_path):
+        time.sleep(self.LOAD_SECONDS)
+        FakeInterpreter.loads += 1
+        self.shape = [1, 224, 224, 3]
+
+    def allocate_tensors(self):
+        self.input = np.zeros(self.shape, np.float32)
+
+    def get_input_details(self):
+        return [{"index": 0, "shape": np.array(self.shape)}]
+
+    def get_output_details(self):
+        return [{"index": 1}]
+
+    def resize_tensor_input(self, index, shape):
+        self.shape = list(shape)
+
+    def tensor(self, index):
+        return lambda: self.input
+
+    def invoke(self):
+        # Bright images are "benign", dark ones "malignant"
+        m = self.input.mean(axis=(1, 2, 3))
+        self.output = np.stack([1 - m, np.zeros_like(m), m], 1)
+
+    def get_tensor(self, index):
+        return self.output.copy()
+
+
+class Request:
+    method = "POST"
+    files = {}
+
+    def __init__(self, data):
+        self.data = data
+
+    def get_data(self):
+        return self.data
+
+
+@pytest.fixture
+def main(monkeypatch):
+    https_fn = types.SimpleNamespace(Response=Response, Request=Request,
+                                     on_request=lambda **kw: lambda f: f)
+    options = types.SimpleNamespace(MemoryOption=types.SimpleNamespace(GB_2="2GB"))
+    tflite = types.ModuleType("tflite_runtime")
+    tflite.interpreter = types.SimpleNamespace(Interpreter=FakeInterpreter)
+    monkeypatch.setitem(sys.modules, "firebase_functions",
+                        types.SimpleNamespace(https_fn=https_fn, options=options))
+    monkeypatch.setitem(sys.modules, "firebase_admin",
+                        types.SimpleNamespace(initialize_app=lambda: None))
+    monkeypatch.setitem(sys.modules, "tflite_runtime", tflite)
+    monkeypatch.setitem(sys.modules, "tflite_runtime.interpreter", tflite.interpreter)
+    monkeypatch.delitem(sys.modules, "main", raising=False)
+    FakeInterpreter.loads = 0
+    return importlib.import_module("main")  # a fresh, cold instance
+
+
+def png(value):
+    return cv2.imencode(".png", np.full((30, 30, 3), value, np.uint8))[1].tobytes()
+
+
+def length_prefixed(*images):
+    return b"".join(struct.pack(">I", len(data)) + data for data in images)
+
+
+def test_classify(main):
+    result = main.classify(Request(png(250))).json()
+    assert result["label"] == "benign"
+    assert result["cold_start"]
+
+
+def test_classify_rejects_empty_and_junk_uploads(main):
+    for data in (b"", b"not an image"):
+        response = main.classify(Request(data))
+        assert response.status == 400
+        assert response.json() == {"error": "could not decode image"}
+    assert FakeInterpreter.loads == 0
+
+
+def test_classify_batch_reports_bad_items_in_band(main, monkeypatch):
+    monkeypatch.setattr(main, "BATCH_MAX", 2)
+    lines = main.classify_batch(Request(length_prefixed(
+        png(255), b"", b"junk", png(0), png(240)))).lines()
+
+    summary = lines.pop()
+    assert summary["done"] and summary["count"] == 5
+    # Errors are written straight away, results as their batch finishes
+    lines.sort(key=lambda line: line["index"])
+    assert [line.get("label", line.get("error")) for line in lines] == [
+        "benign", "could not decode image", "could not decode image", "malignant", "benign"]
+
+
+def test_classify_batch_rejects_a_truncated_body(main):
+    response = main.classify_batch(Request(length_prefixed(png(0))[:-1]))
+    assert response.status == 400
+    assert "runs past the end" in response.json()["error"]
+
+
+def test_concurrent_cold_requests_share_one_load(main):
+    results = []
+
+    def request():
+        results.append(main.classify(Request(png(0))).json())
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert FakeInterpreter.loads == 1
+    # Those that waited for the model are cold starts too
+    assert [r["cold_start"] for r in results] == [True] * 4
+    assert all(r["timing_ms"]["load"] >= FakeInterpreter.LOAD_SECONDS * 900 for r in results)
+
+    warm = main.classify(Request(png(0))).json()
+    assert not warm["cold_start"] and "load" not in warm["timing_ms"]
+    assert warm["model_load_ms"] == results[0]["model_load_ms"]
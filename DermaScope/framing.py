@@ -0,0 +1,64 @@
+# DermaScope wire format, version 1.
+#
+# Every message on the TCP port starts with a fixed big-endian header:
+#
+#   magic 'DSCP' | version B | kind B | flags H | frame_id I | timestamp_ms I
+#   | mode B | reserved B | payload_len I | offset I | chunk_size H | meta_len H
+#
+# followed by meta_len bytes of JSON metadata, then the payload as a run of
+# chunks. Each chunk is a '>HI' (length, CRC32 of the chunk data) prefix plus
+# the data. A zero-length chunk ends the message; its second field holds the
+# number of payload bytes carried by the message.
+#
+# `offset` is where the payload starts within the frame: a resumed transfer
+# (FLAG_RESUMED) picks up at the byte the host asked for instead of 0.
+import struct
+import binascii
+
+MAGIC = b'DSCP'
+VERSION = 1
+HEADER = '>4sBBHIIBBIIHH'
+HEADER_SIZE = struct.calcsize(HEADER)
+CHUNK = '>HI'
+CHUNK_SIZE = struct.calcsize(CHUNK)
+
+# Message kinds
+KIND_FRAME = 1  # JPEG payload
+KIND_MSG = 2    # metadata only, e.g. an error or command reply
+
+# Header flags
+FLAG_RESUMED = 0x01  # payload starts at `offset`
+FLAG_LEN_MAX = 0x02  # payload_len is an upper bound; read up to the terminator
+
+# Sensor modes
+MODE_CAPTURE = 0  # 2592x1944 JPEG
+MODE_PREVIEW = 1  # QVGA JPEG
+MODE_ROI = 2      # 1:1 JPEG of a sensor window, see meta 'roi'
+
+crc32 = binascii.crc32
+
+def pack_header(kind, flags, frame_id, timestamp_ms, mode, payload_len,
+                offset=0, chunk_size=0, meta=b''):
+    return struct.pack(HEADER, MAGIC, VERSION, kind, flags, frame_id,
+                       timestamp_ms & 0xFFFFFFFF, mode, 0, payload_len,
+                       offset, chunk_size, len(meta)) + meta
+
+def pack_chunk(buf, data):
+    # Write the chunk prefix for `data` into the 6-byte `buf`
+    struct.pack_into(CHUNK, buf, 0, len(data), crc32(data))
+    return buf
+
+def pack_end(buf, count):
+    struct.pack_into(CHUNK, buf, 0, 0, count)
+    return buf
+
+def find_eoi(buf, n):
+    # Length of the JPEG in buf[:n], i.e. just past the last FF D9 marker.
+    # Scans backwards: the FIFO pads after EOI and entropy-coded data never
+    # contains FF D9. Returns 0 if there is no marker.
+    i = n - 1
+    while i > 0:
+        if buf[i] == 0xD9 and buf[i - 1] == 0xFF:
+            return i + 1
+        i -= 1
+    return 0
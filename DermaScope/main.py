@@ -1,9 +1,20 @@
 import machine
-import time
+import _thread
+import sys
+import builtins
+import os
 import network
-import socket
 from machine import SPI, I2C, Pin
 import utime
+import uasyncio as asyncio
+import json
+import struct
+from array import array
+import framing
+from framing import (KIND_FRAME, KIND_MSG, FLAG_RESUMED, FLAG_LEN_MAX,
+                     MODE_CAPTURE, MODE_PREVIEW, MODE_ROI)
+from ov5642_regs import (OV5642_QVGA_Preview1, OV5642_QVGA_Preview2,
+                         OV5642_JPEG_Capture_QSXGA, ov5642_2592x1944, ov5642_320x240)
 
 # ==== Global Variables ====
 image_size = 0
@@ -14,575 +25,110 @@ JPEG = 0
 BMP = 1
 RAW = 2
 
-OV5642_QVGA_Preview1=[
-    [0x3103 ,0x93], [0x3008 ,0x82], [0x3017 ,0x7f], [0x3018 ,0xfc], [0x3810 ,0xc2], [0x3615 ,0xf0], [0x3000 ,0x00], [0x3001 ,0x00],
-    [0x3002 ,0x5c], [0x3003 ,0x00], [0x3004 ,0xff], [0x3005 ,0xff], [0x3006 ,0x43], [0x3007 ,0x37], [0x3011 ,0x08], [0x3010 ,0x10],
-    [0x460c ,0x22], [0x3815 ,0x04], [0x370c ,0xa0], [0x3602 ,0xfc], [0x3612 ,0xff], [0x3634 ,0xc0], [0x3613 ,0x00], [0x3605 ,0x7c],
-    [0x3621 ,0x09], [0x3622 ,0x60], [0x3604 ,0x40], [0x3603 ,0xa7], [0x3603 ,0x27], [0x4000 ,0x21], [0x401d ,0x22], [0x3600 ,0x54],
-    [0x3605 ,0x04], [0x3606 ,0x3f], [0x3c01 ,0x80], [0x5000 ,0x4f], [0x5020 ,0x04], [0x5181 ,0x79], [0x5182 ,0x00], [0x5185 ,0x22],
-    [0x5197 ,0x01], [0x5001 ,0xff], [0x5500 ,0x0a], [0x5504 ,0x00], [0x5505 ,0x7f], [0x5080 ,0x08], [0x300e ,0x18], [0x4610 ,0x00],
-    [0x471d ,0x05], [0x4708 ,0x06], [0x3808 ,0x02], [0x3809 ,0x80], [0x380a ,0x01], [0x380b ,0xe0], [0x380e ,0x07], [0x380f ,0xd0],
-    [0x501f ,0x00], [0x5000 ,0x4f], [0x4300 ,0x30], [0x3503 ,0x07], [0x3501 ,0x73], [0x3502 ,0x80], [0x350b ,0x00], [0x3503 ,0x07],
-    [0x3824 ,0x11], [0x3501 ,0x1e], [0x3502 ,0x80], [0x350b ,0x7f], [0x380c ,0x0c], [0x380d ,0x80], [0x380e ,0x03], [0x380f ,0xe8],
-    [0x3a0d ,0x04], [0x3a0e ,0x03], [0x3818 ,0xc1], [0x3705 ,0xdb], [0x370a ,0x81], [0x3801 ,0x80], [0x3621 ,0x87], [0x3801 ,0x50],
-    [0x3803 ,0x08], [0x3827 ,0x08], [0x3810 ,0x40], [0x3804 ,0x05], [0x3805 ,0x00], [0x5682 ,0x05], [0x5683 ,0x00], [0x3806 ,0x03],
-    [0x3807 ,0xc0], [0x5686 ,0x03], [0x5687 ,0xbc], [0x3a00 ,0x78], [0x3a1a ,0x05], [0x3a13 ,0x30], [0x3a18 ,0x00], [0x3a19 ,0x7c],
-    [0x3a08 ,0x12], [0x3a09 ,0xc0], [0x3a0a ,0x0f], [0x3a0b ,0xa0], [0x350c ,0x07], [0x350d ,0xd0], [0x3500 ,0x00], [0x3501 ,0x00],
-    [0x3502 ,0x00], [0x350a ,0x00], [0x350b ,0x00], [0x3503 ,0x00], [0x528a ,0x02], [0x528b ,0x04], [0x528c ,0x08], [0x528d ,0x08],
-    [0x528e ,0x08], [0x528f ,0x10], [0x5290 ,0x10], [0x5292 ,0x00], [0x5293 ,0x02], [0x5294 ,0x00], [0x5295 ,0x02], [0x5296 ,0x00],
-    [0x5297 ,0x02], [0x5298 ,0x00], [0x5299 ,0x02], [0x529a ,0x00], [0x529b ,0x02], [0x529c ,0x00], [0x529d ,0x02], [0x529e ,0x00],
-    [0x529f ,0x02], [0x3030 ,0x0b], [0x3a02 ,0x00], [0x3a03 ,0x7d], [0x3a04 ,0x00], [0x3a14 ,0x00], [0x3a15 ,0x7d], [0x3a16 ,0x00],
-    [0x3a00 ,0x78], [0x3a08 ,0x09], [0x3a09 ,0x60], [0x3a0a ,0x07], [0x3a0b ,0xd0], [0x3a0d ,0x08], [0x3a0e ,0x06], [0x5193 ,0x70],
-    [0x589b ,0x04], [0x589a ,0xc5], [0x401e ,0x20], [0x4001 ,0x42], [0x401c ,0x04], [0x528a ,0x01], [0x528b ,0x04], [0x528c ,0x08],
-    [0x528d ,0x10], [0x528e ,0x20], [0x528f ,0x28], [0x5290 ,0x30], [0x5292 ,0x00], [0x5293 ,0x01], [0x5294 ,0x00], [0x5295 ,0x04],
-    [0x5296 ,0x00], [0x5297 ,0x08], [0x5298 ,0x00], [0x5299 ,0x10], [0x529a ,0x00], [0x529b ,0x20], [0x529c ,0x00], [0x529d ,0x28],
-    [0x529e ,0x00],
-    [0x529f ,0x30],
-    [0x5282 ,0x00],
-    [0x5300 ,0x00],
-    [0x5301 ,0x20],
-    [0x5302 ,0x00],
-    [0x5303 ,0x7c],
-    [0x530c ,0x00],
-    [0x530d ,0x0c],
-    [0x530e ,0x20],
-    [0x530f ,0x80],
-    [0x5310 ,0x20],
-    [0x5311 ,0x80],
-    [0x5308 ,0x20],
-    [0x5309 ,0x40],
-    [0x5304 ,0x00],
-    [0x5305 ,0x30],
-    [0x5306 ,0x00],
-    [0x5307 ,0x80],
-    [0x5314 ,0x08],
-    [0x5315 ,0x20],
-    [0x5319 ,0x30],
-    [0x5316 ,0x10],
-    [0x5317 ,0x00],
-    [0x5318 ,0x02],
-    [0x5402 ,0x3f],
-    [0x5403 ,0x00],
-    [0x3406 ,0x00],
-    [0x5180 ,0xff],
-    [0x5181 ,0x52],
-    [0x5182 ,0x11],
-    [0x5183 ,0x14],
-    [0x5184 ,0x25],
-    [0x5185 ,0x24],
-    [0x5186 ,0x06],
-    [0x5187 ,0x08],
-    [0x5188 ,0x08],
-    [0x5189 ,0x7c],
-    [0x518a ,0x60],
-    [0x518b ,0xb2],
-    [0x518c ,0xb2],
-    [0x518d ,0x44],
-    [0x518e ,0x3d],
-    [0x518f ,0x58],
-    [0x5190 ,0x46],
-    [0x5191 ,0xf8],
-    [0x5192 ,0x04],
-    [0x5193 ,0x70],
-    [0x5194 ,0xf0],
-    [0x5195 ,0xf0],
-    [0x5196 ,0x03],
-    [0x5197 ,0x01],
-    [0x5198 ,0x04],
-    [0x5199 ,0x12],
-    [0x519a ,0x04],
-    [0x519b ,0x00],
-    [0x519c ,0x06],
-    [0x519d ,0x82],
-    [0x519e ,0x00],
-    [0x5025 ,0x80],
-    [0x5583 ,0x40],
-    [0x5584 ,0x40],
-    [0x5580 ,0x02],
-    [0x5000 ,0xcf],
-    [0x3710 ,0x10],
-    [0x3632 ,0x51],
-    [0x3702 ,0x10],
-    [0x3703 ,0xb2],
-    [0x3704 ,0x18],
-    [0x370b ,0x40],
-    [0x370d ,0x03],
-    [0x3631 ,0x01],
-    [0x3632 ,0x52],
-    [0x3606 ,0x24],
-    [0x3620 ,0x96],
-    [0x5785 ,0x07],
-    [0x3a13 ,0x30],
-    [0x3600 ,0x52],
-    [0x3604 ,0x48],
-    [0x3606 ,0x1b],
-    [0x370d ,0x0b],
-    [0x370f ,0xc0],
-    [0x3709 ,0x01],
-    [0x3823 ,0x00],
-    [0x5007 ,0x00],
-    [0x5009 ,0x00],
-    [0x5011 ,0x00],
-    [0x5013 ,0x00],
-    [0x519e ,0x00],
-    [0x5086 ,0x00],
-    [0x5087 ,0x00],
-    [0x5088 ,0x00],
-    [0x5089 ,0x00],
-    [0x302b ,0x00],
-    [0x3808 ,0x01],
-    [0x3809 ,0x40],
-    [0x380a ,0x00],
-    [0x380b ,0xf0],
-    [0x3a00 ,0x78],
-    [0x5001 ,0xFF],
-    [0x5583 ,0x50],
-    [0x5584 ,0x50],
-    [0x5580 ,0x02],
-    [0x3c01 ,0x80],
-    [0x3c00 ,0x04],         
-    [0x5800 ,0x48],
-    [0x5801 ,0x31],
-    [0x5802 ,0x21],
-    [0x5803 ,0x1b],
-    [0x5804 ,0x1a],
-    [0x5805 ,0x1e],
-    [0x5806 ,0x29],
-    [0x5807 ,0x38],
-    [0x5808 ,0x26],
-    [0x5809 ,0x17],
-    [0x580a ,0x11],
-    [0x580b ,0xe ],
-    [0x580c ,0xd ],
-    [0x580d ,0xe ],
-    [0x580e ,0x13],
-    [0x580f ,0x1a],
-    [0x5810 ,0x15],
-    [0x5811 ,0xd ],
-    [0x5812 ,0x8 ],
-    [0x5813 ,0x5 ],
-    [0x5814 ,0x4 ],
-    [0x5815 ,0x5 ],
-    [0x5816 ,0x9 ],
-    [0x5817 ,0xd ],
-    [0x5818 ,0x11],
-    [0x5819 ,0xa ],
-    [0x581a ,0x4 ],
-    [0x581b ,0x0 ],
-    [0x581c ,0x0 ],
-    [0x581d ,0x1 ],
-    [0x581e ,0x6 ],
-    [0x581f ,0x9 ],
-    [0x5820 ,0x12],
-    [0x5821 ,0xb ],
-    [0x5822 ,0x4 ],
-    [0xffff,0xff],
-]
-OV5642_QVGA_Preview2=[
-    [0x5823 ,0x0 ],
-    [0x5824 ,0x0 ],
-    [0x5825 ,0x1 ],
-    [0x5826 ,0x6 ],
-    [0x5827 ,0xa ],
-    [0x5828 ,0x17],
-    [0x5829 ,0xf ],
-    [0x582a ,0x9 ],
-    [0x582b ,0x6 ],
-    [0x582c ,0x5 ],
-    [0x582d ,0x6 ],
-    [0x582e ,0xa ],
-    [0x582f ,0xe ],
-    [0x5830 ,0x28],
-    [0x5831 ,0x1a],
-    [0x5832 ,0x11],
-    [0x5833 ,0xe ],
-    [0x5834 ,0xe ],
-    [0x5835 ,0xf ],
-    [0x5836 ,0x15],
-    [0x5837 ,0x1d],
-    [0x5838 ,0x6e],
-    [0x5839 ,0x39],
-    [0x583a ,0x27],
-    [0x583b ,0x1f],
-    [0x583c ,0x1e],
-    [0x583d ,0x23],
-    [0x583e ,0x2f],
-    [0x583f ,0x41],
-    [0x5840 ,0xe ],
-    [0x5841 ,0xc ],
-    [0x5842 ,0xd ],
-    [0x5843 ,0xc ],
-    [0x5844 ,0xc ],
-    [0x5845 ,0xc ],
-    [0x5846 ,0xc ],
-    [0x5847 ,0xc ],
-    [0x5848 ,0xd ],
-    [0x5849 ,0xe ],
-    [0x584a ,0xe ],
-    [0x584b ,0xa ],
-    [0x584c ,0xe ],
-    [0x584d ,0xe ],
-    [0x584e ,0x10],
-    [0x584f ,0x10],
-    [0x5850 ,0x11],
-    [0x5851 ,0xa ],
-    [0x5852 ,0xf ],
-    [0x5853 ,0xe ],
-    [0x5854 ,0x10],
-    [0x5855 ,0x10],
-    [0x5856 ,0x10],
-    [0x5857 ,0xa ],
-    [0x5858 ,0xe ],
-    [0x5859 ,0xe ],
-    [0x585a ,0xf ],
-    [0x585b ,0xf ],
-    [0x585c ,0xf ],
-    [0x585d ,0xa ],
-    [0x585e ,0x9 ],
-    [0x585f ,0xd ],
-    [0x5860 ,0xc ],
-    [0x5861 ,0xb ],
-    [0x5862 ,0xd ],
-    [0x5863 ,0x7 ],
-    [0x5864 ,0x17],
-    [0x5865 ,0x14],
-    [0x5866 ,0x18],
-    [0x5867 ,0x18],
-    [0x5868 ,0x16],
-    [0x5869 ,0x12],
-    [0x586a ,0x1b],
-    [0x586b ,0x1a],
-    [0x586c ,0x16],
-    [0x586d ,0x16],
-    [0x586e ,0x18],
-    [0x586f ,0x1f],
-    [0x5870 ,0x1c],
-    [0x5871 ,0x16],
-    [0x5872 ,0x10],
-    [0x5873 ,0xf ],
-    [0x5874 ,0x13],
-    [0x5875 ,0x1c],
-    [0x5876 ,0x1e],
-    [0x5877 ,0x17],
-    [0x5878 ,0x11],
-    [0x5879 ,0x11],
-    [0x587a ,0x14],
-    [0x587b ,0x1e],
-    [0x587c ,0x1c],
-    [0x587d ,0x1c],
-    [0x587e ,0x1a],
-    [0x587f ,0x1a],
-    [0x5880 ,0x1b],
-    [0x5881 ,0x1f],
-    [0x5882 ,0x14],
-    [0x5883 ,0x1a],
-    [0x5884 ,0x1d],
-    [0x5885 ,0x1e],
-    [0x5886 ,0x1a],
-    [0x5887 ,0x1a],       
-    [0x5180 ,0xff],
-    [0x5181 ,0x52],
-    [0x5182 ,0x11],
-    [0x5183 ,0x14],
-    [0x5184 ,0x25],
-    [0x5185 ,0x24],
-    [0x5186 ,0x14],
-    [0x5187 ,0x14],
-    [0x5188 ,0x14],
-    [0x5189 ,0x69],
-    [0x518a ,0x60],
-    [0x518b ,0xa2],
-    [0x518c ,0x9c],
-    [0x518d ,0x36],
-    [0x518e ,0x34],
-    [0x518f ,0x54],
-    [0x5190 ,0x4c],
-    [0x5191 ,0xf8],
-    [0x5192 ,0x04],
-    [0x5193 ,0x70],
-    [0x5194 ,0xf0],
-    [0x5195 ,0xf0],
-    [0x5196 ,0x03],
-    [0x5197 ,0x01],
-    [0x5198 ,0x05],
-    [0x5199 ,0x2f],
-    [0x519a ,0x04],
-    [0x519b ,0x00],
-    [0x519c ,0x06],
-    [0x519d ,0xa0],
-    [0x519e ,0xa0],        
-    [0x528a ,0x00],
-    [0x528b ,0x01],
-    [0x528c ,0x04],
-    [0x528d ,0x08],
-    [0x528e ,0x10],
-    [0x528f ,0x20],
-    [0x5290 ,0x30],
-    [0x5292 ,0x00],
-    [0x5293 ,0x00],
-    [0x5294 ,0x00],
-    [0x5295 ,0x01],
-    [0x5296 ,0x00],
-    [0x5297 ,0x04],
-    [0x5298 ,0x00],
-    [0x5299 ,0x08],
-    [0x529a ,0x00],
-    [0x529b ,0x10],
-    [0x529c ,0x00],
-    [0x529d ,0x20],
-    [0x529e ,0x00],
-    [0x529f ,0x30],
-    [0x5282 ,0x00],
-    [0x5300 ,0x00],
-    [0x5301 ,0x20],
-    [0x5302 ,0x00],
-    [0x5303 ,0x7c],
-    [0x530c ,0x00],
-    [0x530d ,0x10],
-    [0x530e ,0x20],
-    [0x530f ,0x80],
-    [0x5310 ,0x20],
-    [0x5311 ,0x80],
-    [0x5308 ,0x20],
-    [0x5309 ,0x40],
-    [0x5304 ,0x00],
-    [0x5305 ,0x30],
-    [0x5306 ,0x00],
-    [0x5307 ,0x80],
-    [0x5314 ,0x08],
-    [0x5315 ,0x20],
-    [0x5319 ,0x30],
-    [0x5316 ,0x10],
-    [0x5317 ,0x00],
-    [0x5318 ,0x02],         
-    [0x5380 ,0x01],  
-    [0x5381 ,0x00],  
-    [0x5382 ,0x00],  
-    [0x5383 ,0x1f],  
-    [0x5384 ,0x00],  
-    [0x5385 ,0x06],  
-    [0x5386 ,0x00],  
-    [0x5387 ,0x00],  
-    [0x5388 ,0x00],  
-    [0x5389 ,0xE1],  
-    [0x538A ,0x00],  
-    [0x538B ,0x2B],  
-    [0x538C ,0x00],  
-    [0x538D ,0x00],  
-    [0x538E ,0x00],  
-    [0x538F ,0x10],  
-    [0x5390 ,0x00],  
-    [0x5391 ,0xB3],  
-    [0x5392 ,0x00],  
-    [0x5393 ,0xA6],  
-    [0x5394 ,0x08],        
-    [0x5480 ,0x0c],  
-    [0x5481 ,0x18],  
-    [0x5482 ,0x2f],  
-    [0x5483 ,0x55],  
-    [0x5484 ,0x64],  
-    [0x5485 ,0x71],  
-    [0x5486 ,0x7d],  
-    [0x5487 ,0x87],  
-    [0x5488 ,0x91],  
-    [0x5489 ,0x9a],  
-    [0x548A ,0xaa],  
-    [0x548B ,0xb8],  
-    [0x548C ,0xcd],  
-    [0x548D ,0xdd],  
-    [0x548E ,0xea],  
-    [0x548F ,0x1d],  
-    [0x5490 ,0x05],  
-    [0x5491 ,0x00],  
-    [0x5492 ,0x04],  
-    [0x5493 ,0x20],  
-    [0x5494 ,0x03],  
-    [0x5495 ,0x60],  
-    [0x5496 ,0x02],  
-    [0x5497 ,0xB8],  
-    [0x5498 ,0x02],  
-    [0x5499 ,0x86],  
-    [0x549A ,0x02],  
-    [0x549B ,0x5B],  
-    [0x549C ,0x02],  
-    [0x549D ,0x3B],  
-    [0x549E ,0x02],  
-    [0x549F ,0x1C],  
-    [0x54A0 ,0x02],  
-    [0x54A1 ,0x04],  
-    [0x54A2 ,0x01],  
-    [0x54A3 ,0xED],  
-    [0x54A4 ,0x01],  
-    [0x54A5 ,0xC5],  
-    [0x54A6 ,0x01],  
-    [0x54A7 ,0xA5],  
-    [0x54A8 ,0x01],  
-    [0x54A9 ,0x6C],  
-    [0x54AA ,0x01],  
-    [0x54AB ,0x41],  
-    [0x54AC ,0x01],  
-    [0x54AD ,0x20],  
-    [0x54AE ,0x00],  
-    [0x54AF ,0x16],  
-    [0x54B0 ,0x01], 
-    [0x54B1 ,0x20], 
-    [0x54B2 ,0x00],
-    [0x54B3 ,0x10], 
-    [0x54B4 ,0x00],
-    [0x54B5 ,0xf0], 
-    [0x54B6 ,0x00],
-    [0x54B7 ,0xDF], 
-    [0x5402 ,0x3f], 
-    [0x5403 ,0x00],
-    [0x5500 ,0x10],
-    [0x5502 ,0x00],
-    [0x5503 ,0x06],
-    [0x5504 ,0x00],
-    [0x5505 ,0x7f],           
-    [0x5025 ,0x80],
-    [0x3a0f ,0x30],
-    [0x3a10 ,0x28],
-    [0x3a1b ,0x30],
-    [0x3a1e ,0x28],
-    [0x3a11 ,0x61],
-    [0x3a1f ,0x10],
-    [0x5688 ,0xfd],
-    [0x5689 ,0xdf],
-    [0x568a ,0xfe],
-    [0x568b ,0xef],
-    [0x568c ,0xfe],
-    [0x568d ,0xef],
-    [0x568e ,0xaa],
-    [0x568f ,0xaa],
-    [0xffff,0xff],
-]
-
-OV5642_JPEG_Capture_QSXGA  =[
-    [0x3503 ,0x07],
-    [0x3000 ,0x00],
-    [0x3001 ,0x00],	
-    [0x3002 ,0x00],	
-    [0x3003 ,0x00],	
-    [0x3005 ,0xff],	
-    [0x3006 ,0xff],	
-    [0x3007 ,0x3f],	
-    [0x350c ,0x07],	
-    [0x350d ,0xd0],	
-    [0x3602 ,0xe4],	
-    [0x3612 ,0xac],	
-    [0x3613 ,0x44],	
-    [0x3621 ,0x27],	
-    [0x3622 ,0x08],	
-    [0x3623 ,0x22],	
-    [0x3604 ,0x60],	
-    [0x3705 ,0xda],	
-    [0x370a ,0x80],	
-    [0x3801 ,0x8a],	
-    [0x3803 ,0x0a],	
-    [0x3804 ,0x0a],	
-    [0x3805 ,0x20],	
-    [0x3806 ,0x07],	
-    [0x3807 ,0x98],	
-    [0x3808 ,0x0a],	
-    [0x3809 ,0x20],	
-    [0x380a ,0x07],	
-    [0x380b ,0x98],	
-    [0x380c ,0x0c],	
-    [0x380d ,0x80],	
-    [0x380e ,0x07],	
-    [0x380f ,0xd0],	
-    [0x3810 ,0xc2],
-    [0x3815 ,0x44],
-    [0x3818 ,0xc8],	
-    [0x3824 ,0x01],	
-    [0x3827 ,0x0a],	
-    [0x3a00 ,0x78],	
-    [0x3a0d ,0x10],	
-    [0x3a0e ,0x0d],	
-    [0x3a10 ,0x32],	
-    [0x3a1b ,0x3c],	
-    [0x3a1e ,0x32],	
-    [0x3a11 ,0x80],	
-    [0x3a1f ,0x20],	
-    [0x3a00 ,0x78],	
-    [0x460b ,0x35],	
-    [0x471d ,0x00],	
-    [0x4713 ,0x03],	
-    [0x471c ,0x50],	
-    [0x5682 ,0x0a],	
-    [0x5683 ,0x20],	
-    [0x5686 ,0x07],	
-    [0x5687 ,0x98],	
-    [0x5001 ,0x4f],	
-    [0x589b ,0x00], 
-    [0x589a ,0xc0],	
-    [0x4407 ,0x08],	
-    [0x589b ,0x00],	
-    [0x589a ,0xc0],	
-    [0x3002 ,0x0c],	
-    [0x3002 ,0x00],	
-    [0x3503 ,0x00],	
-    [0x5025, 0x80],
-    [0x3a0f, 0x48],
-    [0x3a10, 0x40],
-    [0x3a1b, 0x4a],
-    [0x3a1e, 0x3e],
-    [0x3a11, 0x70],
-    [0x3a1f, 0x20],
-    [0xffff, 0xff],
-
-]
-
-ov5642_2592x1944=[
-    [0x3800 ,0x1 ],
-    [0x3801 ,0xB0],
-    [0x3802 ,0x0 ],
-    [0x3803 ,0xA ],
-    [0x3804 ,0xA ],
-    [0x3805 ,0x20],
-    [0x3806 ,0x7 ],
-    [0x3807 ,0x98],
-    [0x3808 ,0xA ],
-    [0x3809 ,0x20],
-    [0x380a ,0x7 ],
-    [0x380b ,0x98],
-    [0x380c ,0xc ],
-    [0x380d ,0x80],
-    [0x380e ,0x7 ],
-    [0x380f ,0xd0],
-    [0x5001 ,0x7f],
-    [0x5680 ,0x0 ],
-    [0x5681 ,0x0 ],
-    [0x5682 ,0xA ],
-    [0x5683 ,0x20],
-    [0x5684 ,0x0 ],
-    [0x5685 ,0x0 ],
-    [0x5686 ,0x7 ],
-    [0x5687 ,0x98],
-    [0xffff, 0xff],
-]
-
-
 # Arducam internal register addresses
 ARDUCHIP_TEST1       = 0x00  # For SPI testing
 ARDUCHIP_FIFO        = 0x04  # FIFO control register
 ARDUCHIP_TRIG        = 0x41  # Trigger capture register
 ARDUCHIP_TIM         = 0x03  # Timing control register
-ARDUCHIP_FRAMES      = 0x4300  # This is an example value. You should use the correct register address from your camera datasheet.
+ARDUCHIP_FRAMES      = 0x01  # Bit[2:0]: frames per capture minus one
 CAP_DONE_MASK        = 0x08
 # Useful bit masks
 FIFO_CLEAR_MASK      = 0x01
 FIFO_START_MASK      = 0x02
+FIFO_RDPTR_RST_MASK  = 0x10
 FIFO_DONE_MASK       = 0x08
 VSYNC_LEVEL_MASK     = 0x02
 
+# OV5642 I2C bulk writes
+SENSOR_RESET_REG     = 0x3008  # Software reset when bit 7 is set
+SENSOR_RESET_MS      = 5       # Datasheet settle time before the next SCCB access
+SENSOR_BURST         = 32      # Max data bytes per coalesced I2C write
+# Registers the sensor changes on its own (AWB gains, AEC/AGC) or that act on
+# every write (reset/standby, group hold): never skipped, never shadowed
+SENSOR_VOLATILE      = ((0x3008, 0x3008), (0x3212, 0x3212),
+                        (0x3400, 0x3406), (0x3500, 0x350d), (0x56a1, 0x56a1))
+
+# Boot: bounded retries, and AEC/AWB settle polled instead of slept
+ARDUCHIP_RESET_MS    = 10
+BOOT_RETRIES         = 5       # camera detection and SPI test attempts
+BOOT_BACKOFF_MS      = 10      # first retry delay, doubled per retry
+AEC_AVG_REG          = 0x56a1  # average luma readout
+AEC_WPT_REG          = 0x3a0f  # AEC stable range, upper limit
+AEC_BPT_REG          = 0x3a10  # AEC stable range, lower limit
+AWB_GAIN_REG         = 0x3400  # R, G, B gains, 16 bits each
+SETTLE_POLL_MS       = 33      # about one frame
+SETTLE_POLLS         = 2       # in-range reads with unchanged gains in a row
+SETTLE_TIMEOUT_MS    = 1500
+
+# SPI clock calibration: SCLK is stepped up from the first rate until a step
+# fails, then backed off SPI_BAUD_MARGIN steps. The rp2 divider rounds each
+# rate down to 125 MHz / an even number.
+SPI_BAUD_STEPS       = (4000000, 5000000, 6250000, 8000000, 10000000,
+                        12500000, 15625000, 20000000)
+SPI_BAUD_MARGIN      = 1
+SPI_CAL_FILE         = 'spi_cal.json'
+SPI_CAL_BYTES        = 16 * 1024  # FIFO bytes checksummed per step
+SPI_TEST_PATTERNS    = b'\x55\xaa\x00\xff\x5a\xa5\x01\x02\x04\x08\x10\x20\x40\x80\x7f\xfe'
+
+# OV5642 JPEG quantization scale: higher values compress harder
+JPEG_QS_REG          = 0x4407
+QS_DEFAULT           = 0x04
+QS_MIN               = 0x02
+QS_MAX               = 0x20
+
+# Named sensor modes: set_mode writes only what differs from the current state
+SENSOR_MODES = {
+    MODE_CAPTURE: ov5642_2592x1944,
+    MODE_PREVIEW: ov5642_320x240,
+}
+
+# Region of interest: a window of the 2592x1944 capture, read out 1:1 so the
+# lesion keeps full pixel density in a much smaller JPEG. Sensor array
+# window (0x3800-0x3807) and output size (0x3808-0x380b) both shrink to the
+# ROI; the AEC/AWB average window (0x5680-0x5687) covers the whole ROI so
+# exposure is metered on the lesion rather than the surrounding field.
+SENSOR_X0            = 0x1b0  # array window origin in ov5642_2592x1944
+SENSOR_Y0            = 0x00a
+SENSOR_W             = 2592
+SENSOR_H             = 1944
+ROI_MIN              = 64     # smallest window side; widths snap to 16, heights to 8
+
+def roi_window(x, y, w, h):
+    # Snap a requested window to what the JPEG encoder takes and keep it on the sensor
+    w = min(max(w, ROI_MIN), SENSOR_W) // 16 * 16
+    h = min(max(h, ROI_MIN), SENSOR_H) // 8 * 8
+    x = min(max(x, 0), SENSOR_W - w) & ~1
+    y = min(max(y, 0), SENSOR_H - h) & ~1
+    return x, y, w, h
+
+def roi_regs(x, y, w, h):
+    # Register table in the ov5642_regs format for an aligned window
+    regs = bytearray()
+    for addr, val in ((0x3800, SENSOR_X0 + x), (0x3802, SENSOR_Y0 + y), (0x3804, w),
+                      (0x3806, h), (0x3808, w), (0x380a, h), (0x5680, 0),
+                      (0x5682, w), (0x5684, 0), (0x5686, h)):
+        regs += bytes((addr >> 8, addr & 0xff, val >> 8,
+                       addr >> 8, (addr + 1) & 0xff, val & 0xff))
+    return bytes(regs)
+
+def sensor_volatile(addr):
+    for lo, hi in SENSOR_VOLATILE:
+        if lo <= addr <= hi:
+            return True
+    return False
+
 class Arducam:
     def __init__(self, cam_type):
         self.CameraType = cam_type
         self.CameraMode = JPEG
+        self.mode = MODE_CAPTURE  # JPEG output size set by Camera_Init
+        self.roi = None           # (x, y, w, h) of MODE_ROI, see set_roi
+        self.quality = QS_DEFAULT  # JPEG quantization scale set by Camera_Init
+        self.frames = 1  # frames per capture, see set_frames
         
         # SPI setup
-        self.spi = machine.SPI(0, baudrate=4000000, polarity=0, phase=0,
+        self.baud = SPI_BAUD_STEPS[0]  # until calibrate_spi or a saved rate says otherwise
+        self.spi = machine.SPI(0, baudrate=self.baud, polarity=0, phase=0,
                                sck=machine.Pin(2), mosi=machine.Pin(3), miso=machine.Pin(4))
         self.cs = machine.Pin(5, machine.Pin.OUT)
         self.cs.value(1)  # Deselect
@@ -590,12 +136,16 @@ class Arducam:
         # I2C setup
         self.i2c = machine.I2C(0, scl=machine.Pin(1), sda=machine.Pin(0), freq=1000000)
         print('I2C scan:', self.i2c.scan())
+        self.i2c_buf = bytearray(2 + SENSOR_BURST)
+        self.i2c_mv = memoryview(self.i2c_buf)
+        self.i2c_writes = 0
+        self.shadow = {}  # sensor register -> last value written or read
 
-        # Reset Arducam
+    def reset_chip(self):
+        # Pulse the ArduChip reset; Spi_Test polls until it answers again
         self.Spi_write(0x07, 0x80)
-        utime.sleep(0.1)
+        utime.sleep_ms(ARDUCHIP_RESET_MS)
         self.Spi_write(0x07, 0x00)
-        utime.sleep(0.1)
 
     # ----------------- SPI Methods -----------------
     def Spi_write(self, address, value):
@@ -610,6 +160,63 @@ class Arducam:
         self.cs.value(1)
         return result[0]
 
+    def set_baud(self, baud):
+        self.spi.init(baudrate=baud)
+        self.baud = baud
+
+    def spi_patterns_ok(self):
+        # Every bit position both ways through the test register
+        for v in SPI_TEST_PATTERNS:
+            self.Spi_write(ARDUCHIP_TEST1, v)
+            if self.Spi_read(ARDUCHIP_TEST1) != v:
+                return False
+        return True
+
+    def fifo_crc(self, n, buf):
+        # CRC32 of the first n FIFO bytes, read from the start in len(buf) bursts
+        self.reset_fifo_read()
+        self.set_fifo_burst()
+        crc = 0
+        try:
+            while n:
+                k = min(n, len(buf))
+                mv = buf if k == len(buf) else buf[:k]
+                self.spi.readinto(mv)
+                crc = framing.crc32(mv, crc)
+                n -= k
+        finally:
+            self.SPI_CS_HIGH()
+        return crc
+
+    def calibrate_spi(self):
+        # Find the fastest reliable SCLK from SPI_BAUD_STEPS. Each step must pass
+        # the register patterns and re-read the start of a captured frame with
+        # the CRC taken at the first (known good) rate, twice.
+        # Returns the rate chosen, which is also applied.
+        self.set_baud(SPI_BAUD_STEPS[0])
+        self.flush_fifo()
+        self.clear_fifo_flag()
+        self.start_capture()
+        t0 = utime.ticks_ms()
+        while not self.get_bit(ARDUCHIP_TRIG, CAP_DONE_MASK):
+            if utime.ticks_diff(utime.ticks_ms(), t0) > CAPTURE_TIMEOUT_MS:
+                return self.baud  # no frame to check against; stay slow
+            utime.sleep_ms(5)
+        n = min(self.read_fifo_length(), SPI_CAL_BYTES)
+        buf = memoryview(bytearray(1024))
+        ref = self.fifo_crc(n, buf)
+        good = 0
+        for i in range(len(SPI_BAUD_STEPS)):
+            self.set_baud(SPI_BAUD_STEPS[i])
+            if not (self.spi_patterns_ok() and self.fifo_crc(n, buf) == ref
+                    and self.fifo_crc(n, buf) == ref):
+                break
+            good = i
+        self.set_baud(SPI_BAUD_STEPS[max(0, good - SPI_BAUD_MARGIN)])
+        self.flush_fifo()
+        self.clear_fifo_flag()
+        return self.baud
+
     def set_fifo_burst(self):
         self.cs.value(0)
         self.spi.write(bytearray([0x3C]))
@@ -633,72 +240,132 @@ class Arducam:
     def wrSensorReg16_8(self, addr, val):
         buf = bytearray([(addr >> 8) & 0xFF, addr & 0xFF, val])
         self.i2c.writeto(self.get_i2c_addr(), buf)
-        utime.sleep(0.003)
+        self.i2c_writes += 1
+        self.shadow_store(addr, val)
+        if addr == SENSOR_RESET_REG and val & 0x80:
+            utime.sleep_ms(SENSOR_RESET_MS)
+
+    def shadow_store(self, addr, val):
+        if addr == SENSOR_RESET_REG and val & 0x80:
+            self.shadow.clear()  # back to power-on defaults we don't track
+        elif not sensor_volatile(addr):
+            self.shadow[addr] = val
+
+    def wrSensorRegs16_8(self, table):
+        # Write a packed (addr_hi, addr_lo, value) table from ov5642_regs.
+        # Entries the shadow says the sensor already holds are skipped. Runs
+        # of consecutive addresses go out as one auto-increment write, carrying
+        # unchanged registers inside a run rather than splitting it;
+        # a software reset is always written alone and followed by its settle time.
+        buf = self.i2c_buf
+        shadow = self.shadow
+        i = 0
+        n = len(table)
+        while i < n:
+            addr = (table[i] << 8) | table[i + 1]
+            val = table[i + 2]
+            i += 3
+            if shadow.get(addr) == val:
+                continue
+            buf[0] = addr >> 8
+            buf[1] = addr & 0xFF
+            buf[2] = val
+            k = 3
+            if addr != SENSOR_RESET_REG:
+                nxt = addr + 1
+                while (i < n and k < len(buf) and nxt != SENSOR_RESET_REG
+                       and (table[i] << 8) | table[i + 1] == nxt):
+                    buf[k] = table[i + 2]
+                    k += 1
+                    i += 3
+                    nxt += 1
+            self.i2c.writeto(self.get_i2c_addr(), self.i2c_mv[:k])
+            self.i2c_writes += 1
+            for j in range(2, k):
+                self.shadow_store(addr + j - 2, buf[j])
+            if addr == SENSOR_RESET_REG and buf[2] & 0x80:
+                utime.sleep_ms(SENSOR_RESET_MS)
 
     def rdSensorReg16_8(self, addr):
         buf = bytearray([(addr >> 8) & 0xFF, addr & 0xFF])
         self.i2c.writeto(self.get_i2c_addr(), buf)
         result = self.i2c.readfrom(self.get_i2c_addr(), 1)
+        if not sensor_volatile(addr):
+            self.shadow[addr] = result[0]
         return result[0]
 
     def get_i2c_addr(self):
         return 0x3C
 
     # ----------------- Camera Control -----------------
+    def boot_retry(self, attempt):
+        # Short exponential backoff between boot checks
+        if attempt:
+            utime.sleep_ms(BOOT_BACKOFF_MS << (attempt - 1))
+
     def Camera_Detection(self):
-        while True:
+        for attempt in range(BOOT_RETRIES):
+            self.boot_retry(attempt)
             if self.CameraType == 0x5642:
-                self.wrSensorReg16_8(0x300A, 0x00)  # Dummy write to wakeup
-                id_h = self.rdSensorReg16_8(OV5642_CHIPID_HIGH)
-                id_l = self.rdSensorReg16_8(OV5642_CHIPID_LOW)
+                try:
+                    self.wrSensorReg16_8(0x300A, 0x00)  # Dummy write to wakeup
+                    id_h = self.rdSensorReg16_8(OV5642_CHIPID_HIGH)
+                    id_l = self.rdSensorReg16_8(OV5642_CHIPID_LOW)
+                except OSError:
+                    id_h = id_l = 0  # no ACK yet
                 if id_h == 0x56 and id_l == 0x42:
                     print("Detected OV5642")
-                    break
+                    return True
                 else:
                     print("Cannot find OV5642")
-            utime.sleep(1)
-        
+        return False
+
     def Spi_Test(self):
-        while True:
+        for attempt in range(BOOT_RETRIES):
+            self.boot_retry(attempt)
             self.Spi_write(0X00, 0X56)
             value = self.Spi_read(0X00)
             
             # Make sure value is a bytearray or list, and check its first element
             if value == 0x56:
                 print('SPI interface OK')
-                break
+                return True
             else:
                 print('SPI interface Error')
-            utime.sleep(1)
+        return False
+
+    def exposure_state(self):
+        # (average luma inside the AEC stable range, AWB gain bytes)
+        luma = self.rdSensorReg16_8(AEC_AVG_REG)
+        in_range = self.shadow.get(AEC_BPT_REG, 0) <= luma <= self.shadow.get(AEC_WPT_REG, 0xff)
+        gains = self.i2c.readfrom_mem(self.get_i2c_addr(), AWB_GAIN_REG, 6, addrsize=16)
+        return in_range, gains
 
 
     def Camera_Init(self):
+        t0 = utime.ticks_ms()
+        self.i2c_writes = 0
         self.wrSensorReg16_8(0x3008, 0x80)  # Reset the camera
         if self.CameraMode == RAW:
             self.wrSensorReg16_8(OV5642_1280x960_RAW)
             self.wrSensorReg16_8(OV5642_640x480_RAW)
         else:
-            for reg in OV5642_QVGA_Preview1:
-                self.wrSensorReg16_8(reg[0], reg[1])
-            for reg in OV5642_QVGA_Preview2:
-                self.wrSensorReg16_8(reg[0], reg[1])
-            utime.sleep(0.1)
+            self.wrSensorRegs16_8(OV5642_QVGA_Preview1)
+            self.wrSensorRegs16_8(OV5642_QVGA_Preview2)
             if self.CameraMode == JPEG:
-                utime.sleep(0.1)
-                for reg in OV5642_JPEG_Capture_QSXGA:
-                    self.wrSensorReg16_8(reg[0], reg[1])
-                for reg in ov5642_2592x1944:
-                    self.wrSensorReg16_8(reg[0], reg[1])
-                utime.sleep(0.1)
+                self.wrSensorRegs16_8(OV5642_JPEG_Capture_QSXGA)
+                self.wrSensorRegs16_8(ov5642_2592x1944)
                 self.wrSensorReg16_8(0x3818, 0xa8)  # Flip image
                 self.wrSensorReg16_8(0x3621, 0x10)
                 self.wrSensorReg16_8(0x3801, 0xb0)
-                self.wrSensorReg16_8(0x4407, 0x04)
+                self.wrSensorReg16_8(JPEG_QS_REG, self.quality)
             else:
                 reg_val = self.rdSensorReg16_8(0x3818)
                 self.wrSensorReg16_8(0x3818, (reg_val | 0x60) & 0xff)
                 reg_val = self.rdSensorReg16_8(0x3621)
                 self.wrSensorReg16_8(0x3621, reg_val & 0xdf)  # Set other configurations
+        print("Camera_Init:", self.i2c_writes, "I2C writes in",
+              utime.ticks_diff(utime.ticks_ms(), t0), "ms")
 
     def flush_fifo(self):
         self.Spi_write(0x04, 0x01)
@@ -709,6 +376,14 @@ class Arducam:
     def start_capture(self):
         self.Spi_write(0x04, 0x02)
 
+    def set_frames(self, n):
+        # Frames captured back to back into the FIFO per start_capture
+        self.Spi_write(ARDUCHIP_FRAMES, n - 1)
+        self.frames = n
+
+    def reset_fifo_read(self):
+        self.Spi_write(ARDUCHIP_FIFO, FIFO_RDPTR_RST_MASK)
+
     def read_fifo_length(self):
         len1 = self.Spi_read(0x42)
         len2 = self.Spi_read(0x43)
@@ -727,138 +402,1424 @@ class Arducam:
     def get_bit(self, addr, bit):
         val = self.Spi_read(addr)
         return val & bit
-    def OV5642_set_JPEG_size():
+    def OV5642_set_JPEG_size(self):
         self.wrSensorRegs16_8(ov5642_2592x1944)
 
+    def set_mode(self, mode):
+        # Switch to a named mode from SENSOR_MODES, e.g. 2592x1944 capture or
+        # QVGA preview. The shadow turns this into the handful of registers
+        # that differ between the two.
+        self.wrSensorRegs16_8(SENSOR_MODES[mode])
+        self.mode = mode
+
+    def set_roi(self, x, y, w, h):
+        # Define the MODE_ROI window; reprogram now if it is the current mode
+        self.roi = roi_window(x, y, w, h)
+        SENSOR_MODES[MODE_ROI] = roi_regs(*self.roi)
+        if self.mode == MODE_ROI:
+            self.set_mode(MODE_ROI)
+        return self.roi
+
+    def set_quality(self, qs):
+        self.wrSensorReg16_8(JPEG_QS_REG, qs)
+        self.quality = qs
+
 
 # ==== Wi-Fi Setup ====
 def setup_ap_mode():
+    # Returns at once; wait_ap_up() waits for the interface from main()
     ap = network.WLAN(network.AP_IF)
     ap.active(True)
     ap.config(essid="DermaScope", password="password123")
+    return ap
+
+async def wait_ap_up(ap):
     while not ap.active():
-        time.sleep(0.5)
+        await asyncio.sleep_ms(10)
     print("AP up! IFCONFIG:", ap.ifconfig())
 
 # ==== TCP Server ====
-def setup_tcp_server():
-    addr = socket.getaddrinfo('0.0.0.0', 4242)[0][-1]
-    s = socket.socket()
-    s.bind(addr)
-    s.listen(1)
-    print('TCP server listening on', addr)
-    return s
-
-# Setup button (e.g., GPIO 15)
+TCP_PORT = 4242
+MJPEG_PORT = 8080
+SEND_TIMEOUT_MS = 2000  # A client that can't absorb a chunk this fast is dropped
+clients = []
+
+class Client:
+    def __init__(self, reader, writer, addr=None):
+        self.reader = reader
+        self.writer = writer
+        self.addr = addr or writer.get_extra_info('peername')
+        self.alive = True
+        self.lock = asyncio.Lock()  # one message on the wire at a time
+        self.queue = []             # (frame, offset) waiting to be sent
+        self.wake = asyncio.Event()
+        self.buf = None             # chunk buffer for flash-staged frames
+        self.hdr = bytearray(framing.CHUNK_SIZE)
+
+    async def send(self, buf):
+        if not self.alive:
+            return
+        try:
+            self.writer.write(buf)
+            await asyncio.wait_for_ms(self.writer.drain(), SEND_TIMEOUT_MS)
+        except Exception as e:
+            print('Dropping client', self.addr, e)
+            self.close()
+
+    async def send_msg(self, meta):
+        async with self.lock:
+            await self.send(framing.pack_header(KIND_MSG, 0, 0, utime.ticks_ms(),
+                                                sensor_mode, 0, meta=json.dumps(meta).encode()))
+            await self.send(framing.pack_end(self.hdr, 0))
+
+    def post(self, frame, offset=0):
+        frame.readers += 1
+        self.queue.append((frame, offset))
+        self.wake.set()
+
+    def frame_start(self, frame, offset):
+        return frame.header(FLAG_RESUMED if offset else 0, offset)
+
+    async def send_payload(self, data):
+        await self.send(framing.pack_chunk(self.hdr, data))
+        await self.send(data)
+
+    def frame_end(self, count):
+        return framing.pack_end(self.hdr, count)
+
+    async def send_frame(self, frame, offset):
+        t0 = utime.ticks_us()
+        await self.send(self.frame_start(frame, offset))
+        sent = offset
+        f = None
+        if frame.in_flash:
+            if self.buf is None:
+                self.buf = memoryview(bytearray(STREAM_CHUNK))
+            f = open(frame.path, 'rb')
+            f.seek(offset)
+        try:
+            while sent < frame.length and self.alive:
+                data = frame.chunk(f, sent, self.buf)
+                if not data:
+                    break
+                await self.send_payload(data)
+                sent += len(data)
+        finally:
+            if f:
+                f.close()
+        await self.send(self.frame_end(sent - offset))
+        t1 = utime.ticks_us()
+        elapsed_ms = utime.ticks_diff(t1, t0) // 1000
+        if self.alive:
+            if sent == frame.length:
+                frame.delivered = True
+            note_transfer(sent - offset, elapsed_ms)
+            if not offset:
+                stats['send'].add(utime.ticks_diff(t1, t0))
+                if frame.t_arm is not None:  # None for frames from the flash queue
+                    stats['total'].add(utime.ticks_diff(t1, frame.t_arm))
+        if self.alive and frame.mode != MODE_PREVIEW:
+            print("Frame", frame.frame_id, "sent to", self.addr, ":", sent - offset,
+                  "bytes in", elapsed_ms, "ms,", (sent - offset) * 1000 // max(elapsed_ms, 1), "B/s")
+
+    async def sender(self):
+        # Per-client send task: works through this client's queue at its own pace
+        while self.alive:
+            await self.wake.wait()
+            self.wake.clear()
+            while self.queue and self.alive:
+                frame, offset = self.queue.pop(0)
+                try:
+                    async with self.lock:
+                        await self.send_frame(frame, offset)
+                except Exception as e:
+                    print('Send error', self.addr, e)
+                    self.close()
+                if self.alive:
+                    release(frame)
+                else:
+                    drop(frame)  # dropped mid-frame
+
+    def close(self):
+        if self.alive:
+            self.alive = False
+            self.writer.close()
+            self.wake.set()
+        while self.queue:
+            drop(self.queue.pop()[0])
+        if self in clients:
+            clients.remove(self)
+
+MODE_NAMES = {'CAPTURE': MODE_CAPTURE, 'PREVIEW': MODE_PREVIEW, 'ROI': MODE_ROI}
+
+def status():
+    return {
+        'mode': ('capture', 'preview', 'roi')[sensor_mode],
+        'roi': list(mycam.roi) if mycam.roi else None,
+        'preview': preview_wanted(),
+        'thumb': thumbnails,
+        'burst': [burst_n, burst_k],
+        'frames': frame_counter,
+        'pending': pending_captures,
+        'quality': mycam.quality,
+        'spi_baud': mycam.baud,
+        'budget_ms': frame_budget_ms,
+        'link_bytes_per_s': int(link_rate() * 1000),
+        'busy': not fifo_free.is_set(),
+        'clients': len(clients),
+        'staged': [f.frame_id for f in frames if f.length],
+        'queued': len(backlog),
+        'uptime_ms': utime.ticks_ms(),
+        'boot': boot_times,
+    }
+
+async def handle_command(client, line):
+    # Host commands, one per line:
+    #   CAPTURE [n]            queue n captures (default 1)
+    #   MODE PREVIEW|CAPTURE|ROI  output of CAPTURE: QVGA, 2592x1944 or the ROI
+    #   ROI <x> <y> <w> <h>    window of the 2592x1944 frame to capture 1:1,
+    #                          snapped to the encoder's alignment; selects MODE ROI.
+    #                          A box from a preview frame scales by 2592/320.
+    #   ROI OFF                back to MODE CAPTURE
+    #   PREVIEW ON|OFF         stream QVGA frames back to back; CAPTURE still
+    #                          takes a one-off frame in the MODE resolution
+    #   THUMB ON|OFF           send a QVGA thumbnail ahead of each full capture
+    #   BURST <n> [k]          capture n frames per full capture, send the k
+    #                          sharpest (default 1, at most STAGE_SLOTS);
+    #                          BURST 1 turns it off
+    #   BUDGET <ms>            per-frame send budget for adaptive quality, 0 = off
+    #   QUALITY <qs>           fixed JPEG quantization scale (disables BUDGET)
+    #   CALIBRATE              re-run the SPI clock sweep and save the result
+    #   STATUS                 report capture state
+    #   STATS                  per-stage timing min/mean/max in microseconds
+    #   RESUME <id> <offset>   retransmit a staged or queued frame from a byte offset
+    # Replies come back as KIND_MSG messages; frames arrive as usual.
+    args = line.split()
+    if not args:
+        return
+    cmd = args[0].upper()
+    reply = {'cmd': cmd.lower()}
+    try:
+        if cmd == 'CAPTURE':
+            n = int(args[1]) if len(args) > 1 else 1
+            if n < 1:
+                raise ValueError
+            request_capture(n)
+            reply['queued'] = n
+        elif cmd == 'MODE':
+            await switch_mode(MODE_NAMES[args[1].upper()])
+            reply.update(status())
+        elif cmd == 'ROI':
+            if args[1].upper() == 'OFF':
+                await switch_mode(MODE_CAPTURE)
+            else:
+                x, y, w, h = (int(a) for a in args[1:5])
+                await set_roi(x, y, w, h)
+            reply.update(status())
+        elif cmd == 'PREVIEW':
+            set_preview(args[1].upper() == 'ON')
+            reply.update(status())
+        elif cmd == 'THUMB':
+            set_thumbnails(args[1].upper() == 'ON')
+            reply.update(status())
+        elif cmd == 'BURST':
+            set_burst(int(args[1]), int(args[2]) if len(args) > 2 else 1)
+            reply.update(status())
+        elif cmd == 'BUDGET':
+            set_budget(int(args[1]))
+            reply.update(status())
+        elif cmd == 'QUALITY':
+            await set_quality(int(args[1]))
+            reply.update(status())
+        elif cmd == 'CALIBRATE':
+            await recalibrate_spi()
+            reply.update(status())
+        elif cmd == 'STATUS':
+            reply.update(status())
+        elif cmd == 'STATS':
+            for name in stats:
+                reply[name] = stats[name].summary()
+        elif cmd == 'RESUME':
+            # Retransmit a staged frame from a byte offset, e.g. after a dropped link
+            frame_id, offset = int(args[1]), int(args[2])
+            if offset < 0:
+                raise ValueError
+            for frame in frames + backlog:
+                if frame.frame_id == frame_id and offset < frame.length:
+                    client.post(frame, offset)
+                    return
+            reply['error'] = 'frame %d not staged' % frame_id
+        else:
+            reply['error'] = 'unknown command'
+    except (IndexError, KeyError, ValueError):
+        reply['error'] = 'bad arguments'
+    await client.send_msg(reply)
+
+async def serve_client(reader, writer):
+    client = Client(reader, writer)
+    clients.append(client)
+    print('Client connected from', client.addr)
+    asyncio.create_task(client.sender())
+    kick_sync()
+    trigger.set()  # resume a preview left on by an earlier session
+    try:
+        while client.alive:
+            line = await reader.readline()
+            if not line:
+                break
+            await handle_command(client, line.decode())
+    except Exception as e:
+        print('Client error', client.addr, e)
+    client.close()
+    print('Client disconnected', client.addr)
+
+class MjpegClient(Client):
+    # Browser-friendly view of the same frames: multipart/x-mixed-replace,
+    # one JPEG per part, no CRC chunking or resume.
+    def frame_start(self, frame, offset):
+        return b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % frame.length
+
+    async def send_payload(self, data):
+        await self.send(data)
+
+    def frame_end(self, count):
+        return b'\r\n'
+
+    async def send_msg(self, meta):
+        pass
+
+async def serve_mjpeg(reader, writer):
+    # Any GET gets the live stream; headers are read and ignored
+    while True:
+        line = await reader.readline()
+        if not line or line == b'\r\n':
+            break
+    client = MjpegClient(reader, writer)
+    await client.send(b'HTTP/1.1 200 OK\r\n'
+                      b'Content-Type: multipart/x-mixed-replace; boundary=frame\r\n'
+                      b'Cache-Control: no-cache\r\n\r\n')
+    clients.append(client)
+    print('MJPEG viewer connected from', client.addr)
+    trigger.set()  # start previewing if we weren't already
+    asyncio.create_task(client.sender())
+    try:
+        while client.alive and await reader.read(64):
+            pass
+    except Exception:
+        pass
+    client.close()
+    print('MJPEG viewer disconnected', client.addr)
+
+# ==== USB serial transport ====
+# On a tethered station the USB CDC port carries the same protocol as TCP:
+# command lines in, DSCP messages out, over the raw stdin/stdout buffers.
+# It is offered when the board boots on USB power (VBUS on WL_GPIO2) and a
+# host claims it by sending its first command line; until then the REPL
+# console is left alone. While claimed, print() is muted so log lines can't
+# land in the middle of a frame. Big frames skip flash staging for a USB-only
+# audience: one CS-low burst straight from the FIFO outruns flash writes.
+USB_SERIAL = True
+vbus = machine.Pin('WL_GPIO2', machine.Pin.IN)
+
+def quiet(*args, **kwargs):
+    pass
+
+class UsbClient(Client):
+    def close(self):
+        global print
+        Client.close(self)
+        print = builtins.print
+
+def tethered():
+    # Everyone listening is on USB
+    return bool(clients) and all(isinstance(c, UsbClient) for c in clients)
+
+async def serve_usb():
+    global print
+    reader = asyncio.StreamReader(sys.stdin.buffer)
+    writer = asyncio.StreamWriter(sys.stdout.buffer, {})
+    client = None
+    while True:
+        line = await reader.readline()
+        if not line:
+            await asyncio.sleep_ms(IDLE_SLEEP_MS)
+            continue
+        if client is None or not client.alive:
+            print('USB host connected, console muted')
+            print = quiet
+            client = UsbClient(reader, writer, 'usb')
+            clients.append(client)
+            asyncio.create_task(client.sender())
+            kick_sync()
+            trigger.set()  # resume a preview left on by an earlier session
+        try:
+            await handle_command(client, line.decode())
+        except Exception as e:
+            client.close()
+            print('USB client error', e)
+
+async def broadcast(targets, buf):
+    # Fan a buffer out to clients concurrently; slow ones time out alone
+    await asyncio.gather(*[c.send(buf) for c in targets])
+
+# Setup button (e.g., GPIO 15), interrupt-driven
+DEBOUNCE_MS = 20
 button = machine.Pin(15, machine.Pin.IN, machine.Pin.PULL_UP)
+button_flag = asyncio.ThreadSafeFlag()
+button.irq(trigger=machine.Pin.IRQ_FALLING, handler=lambda pin: button_flag.set())
 
-# Global variables
-mode = 0
-start_capture = 0
-stop_flag = 0
-once_number = 128
-value_command = 0
-flag_command = 0
-buffer = bytearray(once_number)
+# Power and capture-done polling
+LOW_POWER = True          # lightsleep between captures while no client is connected
+IDLE_SLEEP_MS = 100
+CAPTURE_TIMEOUT_MS = 3000
+CAPTURE_POLL_MAX_MS = 32
 
-# Initialize camera
+# Camera; brought up by boot_camera on core 1
 mycam = Arducam(0x5642)
-mycam.Camera_Detection()
-mycam.Spi_Test()
-mycam.Camera_Init()
-mycam.Spi_write(ARDUCHIP_TIM, VSYNC_LEVEL_MASK)
-utime.sleep(1)
-mycam.clear_fifo_flag()
-mycam.Spi_write(ARDUCHIP_FRAMES, 0x00)
-
-def read_fifo_burst():
-    count = 0
-    length = mycam.read_fifo_length()
-
-    mycam.SPI_CS_LOW()
-    mycam.set_fifo_burst()
-
-    while count < length:
-        if count + once_number <= length:
-            mycam.spi.readinto(buffer, start=0, end=once_number)
-            usb_cdc.data.write(buffer)
-            count += once_number
+
+def save_spi_baud():
+    try:
+        with open(SPI_CAL_FILE, 'w') as f:
+            json.dump({'baud': mycam.baud}, f)
+    except OSError as e:
+        print('Could not save SPI clock:', e)
+
+def calibrate_spi():
+    t0 = utime.ticks_ms()
+    mycam.calibrate_spi()
+    print('SPI clock calibrated to', mycam.baud, 'in',
+          utime.ticks_diff(utime.ticks_ms(), t0), 'ms:', mycam.spi)
+    save_spi_baud()
+
+def setup_spi_clock():
+    # Reuse the saved rate while it still passes the register patterns;
+    # sweep (and save) only on first boot or when it stops working
+    try:
+        with open(SPI_CAL_FILE) as f:
+            mycam.set_baud(json.load(f)['baud'])
+        if mycam.spi_patterns_ok():
+            print('SPI clock', mycam.baud, 'from', SPI_CAL_FILE)
+            return
+        print('Saved SPI clock', mycam.baud, 'failed, recalibrating')
+    except (OSError, ValueError, KeyError):
+        pass
+    calibrate_spi()
+
+# ==== Streaming transfer ====
+# One buffer for every FIFO drain: readinto reuses it, so a 5 MP JPEG costs
+# no per-chunk allocations and no GC pauses mid-transfer.
+STREAM_CHUNK = 4096
+stream_buf = bytearray(STREAM_CHUNK)
+stream_mv = memoryview(stream_buf)
+
+stream_hdr = bytearray(framing.CHUNK_SIZE)
+
+async def stream_fifo(targets, length):
+    # Burst-read `length` FIFO bytes and push them to `targets` as CRC'd chunks,
+    # stopping at the JPEG EOI in the last chunk.
+    # Returns (bytes_sent, elapsed_us, spi_us); throughput is bounded by SPI and Wi-Fi only.
+    sent = 0
+    t0 = utime.ticks_us()
+    rd = fifo_reader
+    rd.start(length)
+    try:
+        while any(c.alive for c in targets):
+            mv = await rd.next()
+            if mv is None:
+                break
+            n = len(mv)
+            last = sent + n == length
+            if last:
+                # Drop the FIFO padding after the EOI
+                n = framing.find_eoi(mv, n) or n
+                mv = mv[:n]
+            await broadcast(targets, framing.pack_chunk(stream_hdr, mv))
+            await broadcast(targets, mv)
+            sent += n
+    finally:
+        await rd.stop()
+    await broadcast(targets, framing.pack_end(stream_hdr, sent))
+    return sent, utime.ticks_diff(utime.ticks_us(), t0), rd.spi_us
+
+async def seek_fifo(offset):
+    # The FIFO only rewinds to the start: reset the read pointer and burst-read
+    # past `offset` bytes
+    mycam.reset_fifo_read()
+    if not offset:
+        return
+    rd = fifo_reader
+    rd.start(offset)
+    try:
+        while await rd.next() is not None:
+            pass
+    finally:
+        await rd.stop()
+
+# ==== FIFO readers ====
+# Every FIFO drain goes through fifo_reader, one range at a time:
+#   rd.start(n), then `mv = await rd.next()` until it returns None, and
+#   `await rd.stop()` in a finally. Each chunk is valid until the next call.
+# FifoReader reads inline on core 0. With DUAL_CORE, FifoRing has core 1 do
+# the SPI burst reads into a ring of preallocated chunks while core 0 keeps
+# Wi-Fi, TCP and flash writes going, so the SPI drain of one frame overlaps
+# the sending of the last. Sensor control stays on core 0: it is a few short
+# I2C writes per frame, and asyncio owns the sequencing around it. Core 1 only
+# touches SPI between start() and stop(), which drain_task and capture_task
+# already serialise through fifo_free.
+DUAL_CORE = True
+RING_CHUNKS = 4  # STREAM_CHUNK bytes each
+
+class FifoReader:
+    def __init__(self):
+        self.remaining = 0
+        self.spi_us = 0  # time spent in SPI reads for the current range
+
+    def start(self, length):
+        self.remaining = length
+        self.spi_us = 0
+        mycam.set_fifo_burst()
+
+    async def next(self):
+        n = min(STREAM_CHUNK, self.remaining)
+        if not n:
+            return None
+        mv = stream_mv if n == STREAM_CHUNK else stream_mv[:n]
+        t = utime.ticks_us()
+        mycam.spi.readinto(mv)
+        self.spi_us += utime.ticks_diff(utime.ticks_us(), t)
+        self.remaining -= n
+        return mv
+
+    async def stop(self):
+        self.remaining = 0
+        mycam.SPI_CS_HIGH()
+
+class FifoRing(FifoReader):
+    def __init__(self, n):
+        FifoReader.__init__(self)
+        self.bufs = [memoryview(bytearray(STREAM_CHUNK)) for _ in range(n)]
+        self.lens = [0] * n
+        self.lock = _thread.allocate_lock()  # guards count across cores
+        self.job = _thread.allocate_lock()   # released by start() to wake core 1
+        self.job.acquire()
+        self.filled = asyncio.ThreadSafeFlag()
+        self.length = 0
+        self.tail = 0       # next chunk for core 0
+        self.count = 0      # chunks filled and not yet consumed
+        self.held = False   # core 0 still has the tail chunk
+        self.busy = False   # core 1 owns SPI
+        self.abort = False
+
+    def start(self, length):
+        self.length = self.remaining = length
+        self.spi_us = 0
+        self.tail = 0
+        self.count = 0
+        self.held = False
+        self.abort = False
+        self.busy = True
+        self.job.release()
+
+    async def next(self):
+        if self.held:
+            self.held = False
+            self.tail = (self.tail + 1) % len(self.bufs)
+            with self.lock:
+                self.count -= 1
+        if not self.remaining:
+            return None
+        while True:
+            with self.lock:
+                ready = self.count
+            if ready:
+                break
+            await self.filled.wait()
+        n = self.lens[self.tail]
+        self.held = True
+        self.remaining -= n
+        buf = self.bufs[self.tail]
+        return buf if n == STREAM_CHUNK else buf[:n]
+
+    async def stop(self):
+        self.abort = True
+        while self.busy:
+            await asyncio.sleep_ms(1)
+        self.remaining = 0
+
+    def worker(self):
+        # Core 1: one CS-low burst per job, chunk by chunk into free ring slots
+        n = len(self.bufs)
+        while True:
+            self.job.acquire()
+            mycam.set_fifo_burst()
+            left = self.length
+            head = 0
+            while left and not self.abort:
+                with self.lock:
+                    full = self.count == n
+                if full:
+                    utime.sleep_us(50)
+                    continue
+                k = min(STREAM_CHUNK, left)
+                buf = self.bufs[head]
+                t = utime.ticks_us()
+                mycam.spi.readinto(buf if k == STREAM_CHUNK else buf[:k])
+                self.spi_us += utime.ticks_diff(utime.ticks_us(), t)
+                self.lens[head] = k
+                head = (head + 1) % n
+                with self.lock:
+                    self.count += 1
+                left -= k
+                self.filled.set()
+            mycam.SPI_CS_HIGH()
+            self.busy = False
+
+fifo_reader = FifoRing(RING_CHUNKS) if DUAL_CORE else FifoReader()
+
+# ==== Frame staging ====
+# Double buffering: the FIFO is drained into a staging slot (RAM, or a flash
+# file for frames too big for RAM) so the next exposure can be armed while the
+# previous frame is still on the wire. Frames that fit nowhere are streamed
+# straight from the FIFO as before.
+PIPELINE = True
+STAGE_SLOTS = 2
+STAGE_RAM_BYTES = 32 * 1024
+STAGE_FLASH = True
+slot_free = asyncio.Event()
+
+class Frame:
+    def __init__(self, slot):
+        self.ram = memoryview(bytearray(STAGE_RAM_BYTES))
+        self.path = 'stage%d.jpg' % slot
+        self.frame_id = -1
+        self.timestamp = 0
+        self.mode = MODE_CAPTURE
+        self.meta = b''   # JSON frame metadata for the header
+        self.t_arm = 0    # ticks_us when the exposure was armed
+        self.length = 0   # JPEG length, trimmed at EOI
+        self.thumb = False  # thumbnail sent ahead of a full frame
+        self.in_flash = False
+        self.readers = 0  # clients that still have to send this frame
+        self.delivered = False  # some client got all of it
+        self.staging = False
+
+    def header(self, flags=0, offset=0):
+        return framing.pack_header(KIND_FRAME, flags, self.frame_id, self.timestamp,
+                                   self.mode, self.length, offset, STREAM_CHUNK, self.meta)
+
+    def chunk(self, f, pos, buf):
+        # Next payload chunk from `pos`: a RAM slice, or read into `buf` from the
+        # open staging file `f` for flash-staged frames
+        n = min(STREAM_CHUNK, self.length - pos)
+        if f is None:
+            return self.ram[pos:pos + n]
+        return buf[:f.readinto(buf[:n])]
+
+    def fits(self, length):
+        # Room to stage `length` bytes in this slot. Staging overwrites the
+        # slot's old file, so its space counts as free; if that isn't
+        # enough, idle slots give up their files too.
+        if length <= STAGE_RAM_BYTES:
+            return True
+        if not STAGE_FLASH:
+            return False
+        if flash_room(length, extra=file_size(self.path)):
+            return True
+        return reclaim_stage_files() and flash_room(length)
+
+    async def stage(self, info):
+        # Drain the FIFO into this slot at SPI speed and trim it at the JPEG EOI
+        self.frame_id, self.timestamp, self.mode, length, meta, self.t_arm = info
+        self.thumb = 'full' in meta
+        self.delivered = False
+        self.in_flash = length > STAGE_RAM_BYTES
+        self.staging = True
+        try:
+            await self.drain(length, meta)
+        finally:
+            self.staging = False
+
+    async def drain(self, length, meta):
+        t0 = utime.ticks_us()
+        if self.in_flash:
+            self.length = await drain_to_file(self.path, length)
+            self.stamp(meta, t0)
+            return
+        rd = fifo_reader
+        rd.start(length)
+        try:
+            pos = 0
+            while True:
+                mv = await rd.next()
+                if mv is None:
+                    break
+                self.ram[pos:pos + len(mv)] = mv
+                pos += len(mv)
+        finally:
+            await rd.stop()
+        self.length = framing.find_eoi(self.ram, length) or length
+        self.stamp(meta, t0)
+
+    def stamp(self, meta, t0):
+        # Record the drain time and freeze the metadata for headers
+        self.meta = json.dumps(stamp_spi(meta, t0)).encode()
+
+def file_size(path):
+    try:
+        return os.stat(path)[6]
+    except OSError:
+        return 0
+
+def flash_room(length, reserve=0, extra=0):
+    # `length` more bytes fit on flash with `reserve` left over (and at least
+    # a block or two spare), counting `extra` bytes about to be freed
+    st = os.statvfs('/')
+    return length + max(reserve, 2 * st[0]) <= st[0] * st[3] + extra
+
+def reclaim_stage_files():
+    # Delete the flash files of idle slots; their frames were sent, so this
+    # only costs the chance to RESUME them. Returns True if anything went.
+    freed = False
+    for f in frames:
+        if f.readers or f.staging:
+            continue
+        if f.in_flash:
+            f.length = 0
+        try:
+            os.remove(f.path)
+            freed = True
+        except OSError:
+            pass
+    return freed
+
+def stamp_spi(meta, t0):
+    spi_us = utime.ticks_diff(utime.ticks_us(), t0)
+    stats['spi'].add(spi_us)
+    meta['t']['spi'] = spi_us
+    return meta
+
+async def drain_to_file(path, length):
+    # Drain `length` FIFO bytes into a flash file; returns the JPEG length
+    rd = fifo_reader
+    rd.start(length)
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                chunk = await rd.next()
+                if chunk is None:
+                    break
+                mv = chunk
+                f.write(mv)
+                await asyncio.sleep_ms(0)  # let senders run between flash writes
+        # The EOI sits in the last chunk, still valid until stop()
+        n = len(mv)
+        eoi = framing.find_eoi(mv, n)
+        return length - n + eoi if eoi else length
+    finally:
+        await rd.stop()
+
+frames = [Frame(i) for i in range(STAGE_SLOTS)] if PIPELINE else []
+
+def release(frame):
+    frame.readers -= 1
+    if frame.readers == 0:
+        slot_free.set()
+
+def is_live_preview(frame):
+    # A preview frame in a staging slot: superseded by the next one, so
+    # nobody loses anything if it is skipped
+    return frame.mode == MODE_PREVIEW and not frame.thumb and frame in frames
+
+async def acquire_slot():
+    while True:
+        # Reuse the oldest idle slot so recent frames stay available for RESUME
+        idle = [f for f in frames if f.readers == 0]
+        if idle:
+            return min(idle, key=lambda f: f.frame_id)
+        # All slots busy: reclaim live preview frames slow clients haven't
+        # started on yet. Captures and thumbnails are never skipped; staging
+        # waits for them to be sent (or spooled, if their client drops).
+        for c in clients:
+            for entry in [e for e in c.queue if is_live_preview(e[0])]:
+                print('Client', c.addr, 'is behind, skipping a frame')
+                c.queue.remove(entry)
+                release(entry[0])
+        slot_free.clear()
+        if any(f.readers == 0 for f in frames):
+            continue
+        await slot_free.wait()
+
+async def stream_direct(info):
+    # Fallback for frames that can't be staged: clients get them straight from
+    # the FIFO, after finishing whatever staged frames they are still sending.
+    # The EOI isn't known up front, so the length is only an upper bound.
+    # MJPEG viewers can't take a frame whose length isn't known and skip it.
+    frame_id, timestamp, mode, total_size, meta, t_arm = info
+    live = [c for c in clients if not isinstance(c, MjpegClient)]
+    if not live:
+        await enqueue(info)
+        return
+    for c in live:
+        await c.lock.acquire()
+    try:
+        await broadcast(live, framing.pack_header(KIND_FRAME, FLAG_LEN_MAX, frame_id, timestamp,
+                                                  mode, total_size, 0, STREAM_CHUNK,
+                                                  json.dumps(meta).encode()))
+        bytes_sent, elapsed_us, spi_us = await stream_fifo(live, total_size)
+        elapsed_ms = elapsed_us // 1000
+        note_transfer(bytes_sent, elapsed_ms)
+        stats['spi'].add(spi_us)
+        stats['send'].add(elapsed_us)
+        stats['total'].add(utime.ticks_diff(utime.ticks_us(), t_arm))
+        if mode == MODE_CAPTURE:
+            note_frame_size(bytes_sent, meta['q'])
+        print("Image sent:", bytes_sent, "bytes in", elapsed_ms, "ms,",
+              bytes_sent * 1000 // max(elapsed_ms, 1), "B/s")
+    finally:
+        for c in live:
+            c.lock.release()
+
+# ==== Store-and-forward queue ====
+# Captures nobody receives are kept on flash instead of being lost: frames
+# taken with no client connected are drained straight into the queue, and
+# staged frames whose every client dropped before finishing are spooled
+# there from their slot. Each entry is two files: the JPEG, then its frame
+# header (the wire-format header plus metadata, with 'queued' set). The
+# header goes last, so an entry cut short by power loss has none and is
+# discarded at boot. The next client to connect gets the backlog, oldest
+# first, interleaved with live frames; entries are deleted once sent whole.
+# Flash-staged frames are renamed in rather than copied, and when flash runs
+# short the files of idle staging slots are deleted before a frame is
+# turned away. Live preview frames are never queued.
+# Frame ids carry on from the backlog after a reboot, so they stay unique.
+QUEUE = True
+QUEUE_DIR = 'queue'
+QUEUE_MAX = 64                    # entries
+QUEUE_RESERVE_BYTES = 16 * 1024   # flash left free for staging and the SPI calibration
+backlog = []                      # QueuedFrame, oldest first
+queue_seq = 0                     # last entry number handed out
+syncing = False
+
+class QueuedFrame(Frame):
+    # A queue entry, sent through the same Client path as a flash-staged frame
+    def __init__(self, base, hdr):
+        fields = struct.unpack_from(framing.HEADER, hdr)
+        self.path = base + '.jpg'
+        self.base = base
+        self.frame_id = fields[4]
+        self.timestamp = fields[5]
+        self.mode = fields[6]
+        self.length = fields[8]
+        self.meta = hdr[framing.HEADER_SIZE:]
+        self.t_arm = None
+        self.thumb = False
+        self.in_flash = True
+        self.readers = 0
+        self.delivered = False
+
+    def remove(self):
+        for ext in ('.hdr', '.jpg'):
+            try:
+                os.remove(self.base + ext)
+            except OSError:
+                pass
+
+def queue_room(length):
+    # Room for an entry bringing `length` new bytes of JPEG (0 when a staged
+    # file is renamed into the queue, which only needs its header)
+    if not QUEUE or len(backlog) >= QUEUE_MAX:
+        return False
+    reserve = QUEUE_RESERVE_BYTES if length else 0
+    if flash_room(length, reserve):
+        return True
+    return reclaim_stage_files() and flash_room(length, reserve)
+
+def worth_queueing(mode, thumb):
+    # Live preview frames are superseded by the next one; thumbnails are kept
+    return mode != MODE_PREVIEW or thumb
+
+def queue_base():
+    global queue_seq
+    queue_seq += 1
+    return '%s/%06d' % (QUEUE_DIR, queue_seq)
+
+def commit_queued(base, frame_id, timestamp, mode, length, meta):
+    # Writing the header is what makes the entry valid
+    meta['queued'] = True
+    hdr = framing.pack_header(KIND_FRAME, 0, frame_id, timestamp, mode, length,
+                              0, STREAM_CHUNK, json.dumps(meta).encode())
+    with open(base + '.hdr', 'wb') as f:
+        f.write(hdr)
+    backlog.append(QueuedFrame(base, hdr))
+    print("Frame", frame_id, "queued,", len(backlog), "waiting")
+    kick_sync()
+
+async def enqueue(info):
+    # No one to send to: drain the FIFO straight into the queue
+    frame_id, timestamp, mode, length, meta, t_arm = info
+    if not worth_queueing(mode, 'full' in meta):
+        return
+    if not queue_room(length):
+        print("Queue full, frame", frame_id, "dropped")
+        return
+    base = queue_base()
+    t0 = utime.ticks_us()
+    length = await drain_to_file(base + '.jpg', length)
+    commit_queued(base, frame_id, timestamp, mode, length, stamp_spi(meta, t0))
+
+async def spool(frame):
+    # Copy an undelivered staged frame into the queue, holding its slot meanwhile
+    try:
+        if not queue_room(0 if frame.in_flash else frame.length):
+            print("Queue full, frame", frame.frame_id, "dropped")
+            return
+        base = queue_base()
+        if frame.in_flash:
+            os.rename(frame.path, base + '.jpg')  # the slot writes a new file next time
         else:
-            remaining = length - count
-            mycam.spi.readinto(buffer, start=0, end=remaining)
-            usb_cdc.data.write(buffer[:remaining])
-            count += remaining
-        utime.sleep(0.00015)
+            with open(base + '.jpg', 'wb') as f:
+                f.write(frame.ram[:frame.length])
+        commit_queued(base, frame.frame_id, frame.timestamp, frame.mode, frame.length,
+                      json.loads(frame.meta))
+        if frame.in_flash:
+            frame.length = 0
+    except OSError as e:
+        print("Queue error:", e)
+    finally:
+        release(frame)
+
+def drop(frame):
+    # A client went away without sending `frame`. If it was the last one that
+    # could, keep the frame on flash; live preview frames are not worth it.
+    if (frame.readers == 1 and not frame.delivered and frame.length
+            and not isinstance(frame, QueuedFrame)
+            and worth_queueing(frame.mode, frame.thumb)):
+        asyncio.create_task(spool(frame))
+    else:
+        release(frame)
+
+def kick_sync():
+    global syncing
+    if syncing or not backlog:
+        return
+    for c in clients:
+        if c.alive and not isinstance(c, MjpegClient):
+            syncing = True
+            asyncio.create_task(sync_backlog(c))
+            return
+
+async def sync_backlog(client):
+    # Bulk-send the queue to `client`, one frame per turn of its lock so
+    # live frames still get through
+    global syncing
+    try:
+        print("Syncing", len(backlog), "queued frames to", client.addr)
+        while backlog and client.alive:
+            frame = backlog[0]
+            try:
+                async with client.lock:
+                    await client.send_frame(frame, 0)
+            except OSError as e:
+                print("Queue error:", e)
+            if not frame.delivered:
+                break
+            backlog.pop(0)
+            frame.remove()
+    finally:
+        syncing = False
+    kick_sync()  # someone else, if this client went away
+
+def load_backlog():
+    # Pick the queue up after a reboot; half-written entries are removed
+    global frame_counter, queue_seq
+    try:
+        names = os.listdir(QUEUE_DIR)
+    except OSError:
+        os.mkdir(QUEUE_DIR)
+        return
+    for name in sorted(names):
+        stem, ext = name[:-4], name[-4:]
+        if (stem + '.jpg' in names) and (stem + '.hdr' in names):
+            if ext == '.jpg':
+                base = QUEUE_DIR + '/' + stem
+                with open(base + '.hdr', 'rb') as f:
+                    backlog.append(QueuedFrame(base, f.read()))
+                frame_counter = max(frame_counter, backlog[-1].frame_id)
+                queue_seq = max(queue_seq, int(stem))
+        else:
+            os.remove(QUEUE_DIR + '/' + name)
+    if backlog:
+        print(len(backlog), "frames queued on flash")
+
+# ==== Telemetry ====
+# Per-stage capture timings in microseconds, kept as rolling min/mean/max over
+# the last STATS_WINDOW samples:
+#   capture   exposure armed -> CAP_DONE
+#   fifo_len  FIFO length register read
+#   spi       FIFO burst drain (into staging, or spread over a direct stream)
+#   send      first header byte -> terminator, per client
+#   total     exposure armed -> frame fully sent, per client
+# Each frame header carries its own capture/fifo_len/spi under 't'.
+STATS_WINDOW = 32
+
+class Stat:
+    def __init__(self):
+        self.ring = array('I', [0] * STATS_WINDOW)
+        self.count = 0
+
+    def add(self, us):
+        self.ring[self.count % STATS_WINDOW] = us
+        self.count += 1
 
-    mycam.SPI_CS_HIGH()
-    mycam.clear_fifo_flag()
+    def summary(self):
+        k = min(self.count, STATS_WINDOW)
+        if not k:
+            return {'n': 0}
+        window = self.ring[:k]
+        return {'n': self.count, 'min': min(window), 'mean': sum(window) // k,
+                'max': max(window)}
 
-# Start AP Mode
-setup_ap_mode()
+stats = {name: Stat() for name in ('capture', 'fifo_len', 'spi', 'send', 'total')}
 
-# Start TCP Server
-server_socket = setup_tcp_server()
+# ==== Tasks ====
+trigger = asyncio.Event()     # button/host -> capture
+sensor_lock = asyncio.Lock()  # no register changes mid-exposure
+fifo_ready = asyncio.Event()  # capture -> drain
+fifo_free = asyncio.Event()   # drain -> capture
+fifo_free.set()
+sensor_ready = asyncio.Event()  # AEC/AWB settled after boot
+fifo_batch = []               # [((frame_id, timestamp_ms, mode, length, meta, t_arm), fifo_offset)]
+frame_counter = 0
+pending_captures = 0
+sensor_mode = MODE_CAPTURE
 
-# --- Accept one client ---
-print('Waiting for a client to connect...')
-client_socket, client_addr = server_socket.accept()
-print('Client connected from', client_addr)
+def request_capture(n=1):
+    global pending_captures
+    pending_captures += n
+    trigger.set()
 
-# Main loop
-while True:
-    if button.value() == 0:  # Button pressed (LOW)
+async def switch_mode(mode):
+    global sensor_mode
+    async with sensor_lock:
+        if mode != mycam.mode:
+            mycam.set_mode(mode)
+        sensor_mode = mode
+
+async def set_roi(x, y, w, h):
+    global sensor_mode
+    async with sensor_lock:
+        mycam.set_roi(x, y, w, h)
+        if mycam.mode != MODE_ROI:
+            mycam.set_mode(MODE_ROI)
+        sensor_mode = MODE_ROI
+
+async def recalibrate_spi():
+    # The sweep uses the FIFO and the sensor, so wait for both to be idle
+    await fifo_free.wait()
+    fifo_free.clear()
+    try:
+        async with sensor_lock:
+            calibrate_spi()
+    finally:
+        fifo_free.set()
+
+# ==== Adaptive JPEG quality ====
+# JPEG size scales roughly with 1/qs. From the measured link rate and the
+# last full frame's size we predict how long the next one will take to send
+# and pick the qs that lands it inside frame_budget_ms. The qs used is
+# reported as 'q' in each frame's metadata.
+FRAME_BUDGET_MS = 0    # per-frame send budget for full captures; 0 = fixed quality
+frame_budget_ms = FRAME_BUDGET_MS
+sent_bytes = 0         # decaying totals over recent transfers; their ratio is the
+sent_ms = 0            # link rate, weighted towards the big transfers that measure it
+last_frame = None      # (bytes, qs) of the last full-resolution frame
+
+def note_transfer(nbytes, ms):
+    global sent_bytes, sent_ms
+    if nbytes < STREAM_CHUNK:
+        return  # too short to say anything about the link
+    sent_bytes = sent_bytes // 2 + nbytes
+    sent_ms = sent_ms // 2 + ms
+
+def link_rate():
+    # bytes/ms, 0 until something has been sent
+    return sent_bytes / sent_ms if sent_ms else 0
+
+def note_frame_size(nbytes, qs):
+    global last_frame
+    last_frame = (nbytes, qs)
+
+def plan_quality():
+    qs = mycam.quality
+    rate = link_rate()
+    if not frame_budget_ms or not rate or not last_frame:
+        return qs
+    predicted_ms = last_frame[0] * last_frame[1] / qs / rate
+    if frame_budget_ms * 0.6 <= predicted_ms <= frame_budget_ms:
+        return qs
+    # Aim for the middle of the band, at most halving/doubling per frame
+    target = qs * predicted_ms / (frame_budget_ms * 0.8)
+    target = max(qs / 2, min(qs * 2, target))
+    return max(QS_MIN, min(QS_MAX, int(target + 0.5)))
+
+def set_budget(ms):
+    global frame_budget_ms
+    frame_budget_ms = max(0, ms)
+
+async def set_quality(qs):
+    set_budget(0)
+    async with sensor_lock:
+        mycam.set_quality(max(QS_MIN, min(QS_MAX, qs)))
+
+# ==== Live preview ====
+# While preview is on and someone is watching, capture_task keeps the sensor
+# in QVGA and captures back to back; staging reclaims frames slow viewers
+# haven't started, so everyone sees the latest frame. Queued CAPTUREs are
+# served in between in the selected MODE, then preview resumes.
+preview_active = False
+MODE_SETTLE_MS = 50  # let the sensor settle after an output size change
+
+def set_preview(on):
+    global preview_active
+    preview_active = on
+    trigger.set()
+
+def preview_wanted():
+    return (preview_active and bool(clients)) or any(isinstance(c, MjpegClient) for c in clients)
+
+# ==== Thumbnails ====
+# With thumbnails on, every full-resolution capture is preceded by a QVGA
+# frame of the same field of view (the 320x240 mode scales the full sensor
+# window). Its metadata carries 'full': the id of the frame that follows (the
+# first of a burst), and the full frame's carries 'thumb'. Staging never skips
+# a queued thumbnail.
+THUMBNAIL = False
+thumbnails = THUMBNAIL
+
+def set_thumbnails(on):
+    global thumbnails
+    thumbnails = on
+
+# ==== Burst capture ====
+# BURST n [k]: each full capture exposes n frames back to back into the FIFO
+# and only the k sharpest are sent. At a fixed quantization scale a sharper
+# frame keeps more detail through quantization and so makes a bigger JPEG:
+# byte size is the score, and one SPI pass over the FIFO finds every frame's
+# bounds and size. Each frame keeps its own id, so skipped ones leave gaps;
+# sent frames carry 'burst': {'n', 'index', 'rank', 'sizes'} in their metadata.
+# k is capped at STAGE_SLOTS, so a whole burst stages at once and the sensor
+# is re-armed without waiting on the link.
+BURST_MAX = 4  # 4 full frames fit the 8 MB FIFO even at QS_MIN
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+burst_n = 1
+burst_k = 1
+
+def set_burst(n, k=1):
+    global burst_n, burst_k
+    burst_n = max(1, min(BURST_MAX, n))
+    burst_k = max(1, min(burst_n, k, STAGE_SLOTS if PIPELINE else BURST_MAX))
+
+async def scan_burst(length, count):
+    # (start, end) of up to `count` JPEGs in the first `length` FIFO bytes.
+    # `last` catches a marker split across two chunks.
+    spans = []
+    start = -1
+    pos = 0
+    last = 0
+    mycam.reset_fifo_read()
+    rd = fifo_reader
+    rd.start(length)
+    try:
+        while len(spans) < count:
+            mv = await rd.next()
+            if mv is None:
+                break
+            chunk = bytes(mv)  # bytearray has no find() on MicroPython
+            i = 0
+            while len(spans) < count:
+                marker = JPEG_SOI if start < 0 else JPEG_EOI
+                if i == 0 and last == 0xFF and chunk[0] == marker[1]:
+                    j = -1
+                else:
+                    j = chunk.find(marker, i)
+                    if j < 0:
+                        break
+                if start < 0:
+                    start = pos + j
+                else:
+                    spans.append((start, pos + j + 2))
+                    start = -1
+                i = j + 2
+            last = chunk[-1]
+            pos += len(chunk)
+            await asyncio.sleep_ms(0)
+    finally:
+        await rd.stop()
+    return spans
+
+async def pick_burst(frame_id, timestamp, mode, length, meta, t_arm, n):
+    # Score the burst in the FIFO and return the drain batch for the best burst_k
+    t0 = utime.ticks_us()
+    spans = await scan_burst(length, n) or [(0, length)]
+    meta['t']['scan'] = utime.ticks_diff(utime.ticks_us(), t0)
+    sizes = [end - start for start, end in spans]
+    ranked = sorted(range(len(spans)), key=lambda i: -sizes[i])[:burst_k]
+    batch = []
+    for rank, i in enumerate(ranked):
+        m = dict(meta)
+        m['t'] = dict(meta['t'])
+        m['burst'] = {'n': n, 'index': i, 'rank': rank, 'sizes': sizes}
+        start, end = spans[i]
+        batch.append(((frame_id + i, timestamp, mode, end - start, m, t_arm), start))
+    print("Burst of", len(spans), "frames, sending", [frame_id + i for i in ranked])
+    return batch
+
+async def button_task():
+    # The pin IRQ only raises a flag; the press counts if the pin is still low
+    # after DEBOUNCE_MS, and a held button fires once.
+    while True:
+        await button_flag.wait()
+        await asyncio.sleep_ms(DEBOUNCE_MS)
+        if button.value() != 0:
+            continue  # bounce or glitch
         print("Button pressed, capturing image...")
+        request_capture()
+        while button.value() == 0:
+            await asyncio.sleep_ms(DEBOUNCE_MS)
+
+async def wait_capture_done():
+    # Poll CAP_DONE with exponential backoff (1, 2, 4 ... CAPTURE_POLL_MAX_MS)
+    # so short exposures are picked up quickly without hammering SPI on long ones
+    t0 = utime.ticks_ms()
+    delay = 1
+    while mycam.get_bit(ARDUCHIP_TRIG, CAP_DONE_MASK) == 0:
+        if utime.ticks_diff(utime.ticks_ms(), t0) > CAPTURE_TIMEOUT_MS:
+            return False
+        await asyncio.sleep_ms(delay)
+        delay = min(delay * 2, CAPTURE_POLL_MAX_MS)
+    return True
+
+async def idle_task():
+    # With nobody connected and nothing to do, doze in short lightsleep slices.
+    # Slices keep the AP serviced between them and bound trigger latency.
+    while True:
+        await asyncio.sleep_ms(IDLE_SLEEP_MS)
+        # lightsleep would stop the USB clock, and on USB power there's no battery to save
+        if (LOW_POWER and not clients and not pending_captures and fifo_free.is_set()
+                and not vbus.value()):
+            machine.lightsleep(IDLE_SLEEP_MS)
+
+async def capture_task():
+    global pending_captures
+    while True:
+        if pending_captures > 0:
+            pending_captures -= 1
+            mode = sensor_mode
+            meta = {}
+            if thumbnails and mode == MODE_CAPTURE:
+                # QVGA of the same field of view first, so the host can start
+                # classifying while the full frame is still on its way
+                thumb_id = await capture_frame(MODE_PREVIEW, {'full': frame_counter + 2})
+                if thumb_id:
+                    meta['thumb'] = thumb_id
+            await capture_frame(mode, meta)
+        elif preview_wanted():
+            await capture_frame(MODE_PREVIEW, {})
+        else:
+            if mycam.mode != sensor_mode:
+                await switch_mode(sensor_mode)  # back from preview
+            await trigger.wait()
+            trigger.clear()
 
+async def capture_frame(mode, meta):
+    # Expose one frame (a burst in MODE_CAPTURE, see BURST) in `mode` and hand
+    # it to drain_task with `meta` added to its metadata. Returns the frame id,
+    # the first of a burst, or 0 if the capture timed out.
+    global fifo_batch, frame_counter
+    await sensor_ready.wait()
+    await fifo_free.wait()
+    fifo_free.clear()
+    n = burst_n if mode == MODE_CAPTURE else 1
+    async with sensor_lock:
         # Flush and start capture
         mycam.flush_fifo()
         mycam.clear_fifo_flag()
-        utime.sleep(0.05)
+        if mycam.mode != mode:
+            mycam.set_mode(mode)
+            await asyncio.sleep_ms(MODE_SETTLE_MS)
+        if mode == MODE_CAPTURE:
+            qs = plan_quality()
+            if qs != mycam.quality:
+                print("JPEG quality scale", mycam.quality, "->", qs)
+                mycam.set_quality(qs)
+        if mycam.frames != n:
+            mycam.set_frames(n)
+        frame_id = frame_counter + 1
+        frame_counter += n
+        timestamp = utime.ticks_ms()
+        t_arm = utime.ticks_us()
         mycam.start_capture()
 
-        # Wait until capture is done
-        while mycam.get_bit(ARDUCHIP_TRIG, CAP_DONE_MASK) == 0:
-            utime.sleep(0.01)
+        if not await wait_capture_done():
+            print("Capture timed out, frame", frame_id)
+            mycam.flush_fifo()
+            mycam.clear_fifo_flag()
+            fifo_free.set()
+            return 0
 
-        print("Capture done, starting image transfer...")
+        t_done = utime.ticks_us()
+        if 'first_image' not in boot_times:
+            boot_mark('first_image')
+        fifo_length = mycam.read_fifo_length()
+        t = {'capture': utime.ticks_diff(t_done, t_arm),
+             'fifo_len': utime.ticks_diff(utime.ticks_us(), t_done)}
+        stats['capture'].add(t['capture'])
+        stats['fifo_len'].add(t['fifo_len'])
+        meta['q'] = mycam.quality
+        if mode == MODE_ROI:
+            meta['roi'] = list(mycam.roi)
+        meta['t'] = t
+    if n > 1:
+        fifo_batch = await pick_burst(frame_id, timestamp, mode, fifo_length, meta, t_arm, n)
+    else:
+        fifo_batch = [((frame_id, timestamp, mode, fifo_length, meta, t_arm), 0)]
+    if mode != MODE_PREVIEW:
+        print("Capture done, frame", frame_id, "size:", fifo_length)
+    fifo_ready.set()
+    return frame_id
 
-        # Read image size
-        total_size = mycam.read_fifo_length()
-        print("Image size:", total_size)
-        chunk_size = 512
-        bytes_sent = 0
+async def drain_task():
+    while True:
+        await fifo_ready.wait()
+        fifo_ready.clear()
+        for info, offset in fifo_batch:
+            if not clients and not QUEUE:
+                print("No client connected, frame dropped")
+                break
+            try:
+                await seek_fifo(offset)
+                if not clients:
+                    await enqueue(info)
+                    continue
+                length = info[3]
+                frame = None
+                if frames and (length <= STAGE_RAM_BYTES or not tethered()):
+                    frame = await acquire_slot()
+                if frame and frame.fits(length):
+                    await frame.stage(info)
+                    if frame.mode == MODE_CAPTURE:
+                        note_frame_size(frame.length, mycam.quality)
+                    for c in clients:
+                        c.post(frame)
+                    if not clients:
+                        frame.readers += 1
+                        drop(frame)  # everyone left while it was staging
+                else:
+                    await stream_direct(info)
+            except Exception as e:
+                print("Transfer error:", e)
 
-        # --- Send total size first ---
-        client_socket.send(total_size.to_bytes(4, 'big'))
+        # Flush FIFO for next capture; the staged frame drains to clients meanwhile
+        mycam.flush_fifo()
+        mycam.clear_fifo_flag()
+        fifo_free.set()
 
-        # --- Start FIFO burst read ---
-        mycam.cs.value(0)
-        mycam.spi.write(bytearray([0x3C]))  # FIFO burst read command
+async def main():
+    await sensor_lock.acquire()  # host commands wait until core 1 has the camera up
+    await wait_ap_up(ap)
+    boot_mark('ap_up')
+    await asyncio.start_server(serve_client, '0.0.0.0', TCP_PORT)
+    print('TCP server listening on port', TCP_PORT)
+    await asyncio.start_server(serve_mjpeg, '0.0.0.0', MJPEG_PORT)
+    print('MJPEG preview on http port', MJPEG_PORT)
+    if USB_SERIAL and vbus.value():
+        asyncio.create_task(serve_usb())
+        print('USB power detected: send a command line over USB CDC to use it')
+    boot_mark('servers')
+    while camera_state is None:
+        await asyncio.sleep_ms(5)
+    for phase, t in zip(CAMERA_PHASES, camera_times):
+        if t:
+            boot_mark(phase, t)
+    if camera_state is not True:
+        print('Camera bring-up failed:', camera_state, '- resetting')
+        machine.reset()
+    sensor_lock.release()
+    if QUEUE:
+        load_backlog()
+        kick_sync()  # clients that connected while the camera came up
+    asyncio.create_task(settle_exposure())
+    asyncio.create_task(button_task())
+    asyncio.create_task(idle_task())
+    asyncio.create_task(drain_task())
+    await capture_task()
 
-        # --- Read and send chunks ---
-        while bytes_sent < total_size:
-            to_read = min(chunk_size, total_size - bytes_sent)
+# ==== Boot ====
+# Power-on to first image. Core 1 brings the camera up (ArduChip reset,
+# detection, register tables, SPI clock) while core 0 starts the AP and the
+# servers, then stays on as the FIFO reader with DUAL_CORE. Checks are
+# retried a bounded number of times; a board that still fails is reset
+# rather than left spinning. Captures wait for AEC/AWB to settle, which is
+# polled rather than slept. Each phase is logged in ms since power-on and
+# reported as 'boot' in STATUS. There is no GIL between the cores, so core 1
+# only writes its own preallocated slots; main() copies them into boot_times.
+boot_times = {}      # phase -> ticks_ms when it finished; core 0 only
+CAMERA_PHASES = ('camera_found', 'camera_init', 'spi_clock')
+camera_times = [0] * len(CAMERA_PHASES)  # written by core 1
+camera_state = None  # None while core 1 boots the camera, then True or the error
 
-            try:
-                chunk = mycam.spi.read(to_read)
-            except Exception as e:
-                print(f"SPI read error: {e}")
-                break
+def boot_mark(phase, t=None):
+    boot_times[phase] = t or utime.ticks_ms()
+    print('Boot:', phase, 'at', boot_times[phase], 'ms')
 
-            try:
-                client_socket.send(chunk)
-            except Exception as e:
-                print(f"Socket send error at byte {bytes_sent}: {e}")
-                break
+def camera_mark(i):
+    camera_times[i] = utime.ticks_ms()
 
-            bytes_sent += len(chunk)
-            print(f"Sent {bytes_sent}/{total_size} bytes")
-            utime.sleep(0.2)
+def boot_camera():
+    global camera_state
+    try:
+        mycam.reset_chip()
+        if not mycam.Camera_Detection():
+            raise OSError('OV5642 not found')
+        if not mycam.Spi_Test():
+            raise OSError('ArduChip SPI test failed')
+        camera_mark(0)
+        mycam.Camera_Init()
+        mycam.Spi_write(ARDUCHIP_TIM, VSYNC_LEVEL_MASK)
+        mycam.clear_fifo_flag()
+        mycam.set_frames(1)
+        camera_mark(1)
+        setup_spi_clock()
+        camera_mark(2)
+    except Exception as e:
+        camera_state = repr(e)
+        return
+    camera_state = True
+    if DUAL_CORE:
+        fifo_reader.worker()
 
-        mycam.cs.value(1)
+async def settle_exposure():
+    # AEC/AWB converge over a few frames after Camera_Init: wait until the
+    # average luma sits in the AEC stable range with the AWB gains unchanged
+    # for SETTLE_POLLS reads, or SETTLE_TIMEOUT_MS, then open up captures
+    t0 = utime.ticks_ms()
+    last = None
+    steady = 0
+    while steady < SETTLE_POLLS:
+        if utime.ticks_diff(utime.ticks_ms(), t0) > SETTLE_TIMEOUT_MS:
+            print('AEC/AWB not settled after', SETTLE_TIMEOUT_MS, 'ms, capturing anyway')
+            break
+        await asyncio.sleep_ms(SETTLE_POLL_MS)
+        async with sensor_lock:
+            in_range, gains = mycam.exposure_state()
+        steady = steady + 1 if in_range and gains == last else 0
+        last = gains
+    boot_mark('sensor_settled')
+    sensor_ready.set()
 
-        # Flush FIFO for next capture
-        mycam.flush_fifo()
-        mycam.clear_fifo_flag()
+boot_mark('start')
+_thread.start_new_thread(boot_camera, ())
+ap = setup_ap_mode()
 
-        print("Image sent successfully!")
-    utime.sleep(0.01)  # Small delay
\ No newline at end of file
+asyncio.run(main())
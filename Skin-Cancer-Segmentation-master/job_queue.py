@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+"""
+Durable inference job queue for the skin lesion models.
+
+Jobs (an image path or the image bytes, plus a priority) live in a SQLite
+database, keyed by the SHA-256 of the image so enqueueing the same image
+twice is a no-op. Worker processes claim jobs in batches sized for the
+model, run the MobileNetV2 classifier and/or the Mask R-CNN segmenter, and
+write each result back as JSON. A claim is a lease: if a worker dies, its
+jobs become claimable again once the lease runs out, so a crashed run
+resumes where it stopped when the workers are started again: jobs held by
+workers on this host that are no longer running are put back at once, and
+workers wait for other leases to finish or run out before exiting. A job
+whose lease has run out MAX_ATTEMPTS times (it keeps killing its worker) is
+marked failed rather than handed out again.
+
+Usage:
+    python job_queue.py enqueue ISIC_2020_Training_JPEG/ --priority 0
+    python job_queue.py work --task classify --workers 2
+    python job_queue.py status
+    python job_queue.py results --csv results.csv
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+import cv2
+import numpy as np
+
+DB_FILE = "jobs.sqlite3"
+CLASSIFIER_FILE = "mobilenet_skin_classifier.h5"
+SEGMENTER_FILE = "mask_rcnn_moles_0090.h5"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Same order and preprocessing as Single_Test.py / mainMB.py
+class_names = ["malignant", "seborrheic_keratosis", "benign"]
+CLASSIFY_SIZE = 224
+# Class ids of the Mask R-CNN head, as registered in main.py
+mask_class_names = ["background", "malignant", "benign", "seborrheic_keratosis"]
+
+BATCH_SIZES = {"classify": 32, "segment": 8, "both": 8}
+LEASE_SECONDS = 600   # a claimed batch not finished by then is handed out again
+LEASE_POLL_SECONDS = 5  # how often an idle worker checks on other workers' leases
+MAX_ATTEMPTS = 3      # a job that fails this often is marked failed
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          INTEGER PRIMARY KEY,
+    hash        TEXT NOT NULL UNIQUE,
+    path        TEXT,
+    data        BLOB,
+    priority    INTEGER NOT NULL DEFAULT 0,
+    state       TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, failed
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    lease_until REAL,
+    result      TEXT,
+    error       TEXT,
+    created     REAL NOT NULL,
+    updated     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (state, priority DESC, id);
+"""
+
+
+class JobQueue:
+    """
+    SQLite-backed job store shared by every process that opens the same file.
+    WAL mode lets workers write results while others claim.
+    """
+
+    def __init__(self, db_path=DB_FILE):
+        self.db = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def enqueue(self, path=None, data=None, priority=0):
+        """
+        Queues one image, given as a file path or as encoded bytes.
+        Returns (job id, True if new) - an image already queued keeps its job.
+        """
+        if data is None:
+            with open(path, "rb") as f:
+                content = f.read()
+        else:
+            content = data
+        digest = hashlib.sha256(content).hexdigest()
+        now = time.time()
+        cur = self.db.execute(
+            "INSERT OR IGNORE INTO jobs (hash, path, data, priority, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (digest, os.path.abspath(path) if path else None,
+             data if path is None else None, priority, now, now))
+        if cur.rowcount:
+            return cur.lastrowid, True
+        return self.db.execute("SELECT id FROM jobs WHERE hash = ?", (digest,)).fetchone()[0], False
+
+    def claim(self, batch_size, worker):
+        """
+        Leases up to batch_size jobs, highest priority first. Jobs whose lease
+        expired (their worker crashed) are claimable again, until they have
+        been tried MAX_ATTEMPTS times; then they are marked failed.
+        """
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute(
+                "UPDATE jobs SET state = 'failed', lease_until = NULL, updated = ?, "
+                "error = 'lease expired on all ' || attempts || ' attempts' "
+                "WHERE state = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, MAX_ATTEMPTS))
+            rows = self.db.execute(
+                "SELECT id, path, data FROM jobs "
+                "WHERE state = 'queued' OR (state = 'running' AND lease_until < ?) "
+                "ORDER BY priority DESC, id LIMIT ?", (now, batch_size)).fetchall()
+            self.db.executemany(
+                "UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, "
+                "attempts = attempts + 1, updated = ? WHERE id = ?",
+                [(worker, now + LEASE_SECONDS, now, row[0]) for row in rows])
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return rows
+
+    def complete(self, results):
+        """Stores [(job id, result dict)] and marks those jobs done."""
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        self.db.executemany(
+            "UPDATE jobs SET state = 'done', result = ?, error = NULL, lease_until = NULL, "
+            "updated = ? WHERE id = ?",
+            [(json.dumps(result), now, job_id) for job_id, result in results])
+        self.db.execute("COMMIT")
+
+    def fail(self, job_id, error):
+        """Puts a job back in the queue, or marks it failed after MAX_ATTEMPTS."""
+        self.db.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+            "error = ?, lease_until = NULL, updated = ? WHERE id = ?",
+            (MAX_ATTEMPTS, str(error), time.time(), job_id))
+
+    def counts(self):
+        return dict(self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+    def requeue_dead(self):
+        """
+        Puts back jobs leased by workers on this host whose process is gone,
+        instead of leaving them until their lease runs out. A job that has
+        used up MAX_ATTEMPTS is marked failed. Returns how many were touched.
+        """
+        host = socket.gethostname()
+        rows = self.db.execute(
+            "SELECT id, worker FROM jobs WHERE state = 'running' AND worker LIKE ?",
+            (host + ":%",)).fetchall()
+        dead = [(worker, job_id) for job_id, worker in rows
+                if not process_alive(int(worker.rsplit(":", 1)[1]))]
+        self.db.executemany(
+            "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+            "error = 'worker ' || ? || ' died', lease_until = NULL, updated = ? "
+            "WHERE id = ? AND state = 'running'",
+            [(MAX_ATTEMPTS, worker, time.time(), job_id) for worker, job_id in dead])
+        return len(dead)
+
+    def pending(self):
+        """Jobs not finished yet: queued, or leased (including expired leases
+        that will be handed out again)."""
+        return self.db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE state = 'queued' "
+            "OR (state = 'running' AND NOT (lease_until < ? AND attempts >= ?))",
+            (time.time(), MAX_ATTEMPTS)).fetchone()[0]
+
+    def leased(self):
+        """Jobs other workers are holding on to, lease still valid."""
+        return self.db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE state = 'running' AND lease_until >= ?",
+            (time.time(),)).fetchone()[0]
+
+    def results(self):
+        return self.db.execute(
+            "SELECT id, hash, path, state, result, error FROM jobs ORDER BY id")
+
+
+def process_alive(pid):
+    if os.name == "nt":
+        return True  # no signal 0 on Windows; the lease expiry covers it
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# --- MODELS ---
+def load_image(path, data):
+    if data is not None:
+        if not data:  # imdecode raises on an empty buffer
+            return None
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    return cv2.imread(path)
+
+
+class Classifier:
+    """MobileNetV2 classifier from mainMB.py, predicting a whole batch at once."""
+
+    def __init__(self, model_file=CLASSIFIER_FILE):
+        import tensorflow as tf
+        self.model = tf.keras.models.load_model(model_file)
+
+    def __call__(self, images):
+        batch = np.stack([cv2.resize(img, (CLASSIFY_SIZE, CLASSIFY_SIZE)) for img in images])
+        predictions = self.model.predict(batch / 255.0, batch_size=len(batch), verbose=0)
+        results = []
+        for p in predictions:
+            i = int(np.argmax(p))
+            results.append({"label": class_names[i], "confidence": float(p[i]),
+                            "scores": dict(zip(class_names, map(float, p)))})
+        return results
+
+
+class Segmenter:
+    """Mask R-CNN from main.py in inference mode; detect() takes fixed-size batches."""
+
+    def __init__(self, batch_size, model_file=SEGMENTER_FILE):
+        from Mask.config import Config
+        import Mask.model as modellib
+
+        class InferenceConfig(Config):
+            NAME = "moles"
+            GPU_COUNT = 1
+            IMAGES_PER_GPU = batch_size
+            NUM_CLASSES = 1 + 3
+            IMAGE_MIN_DIM = 128
+            IMAGE_MAX_DIM = 128
+
+        self.batch_size = batch_size
+        self.model = modellib.MaskRCNN(mode="inference", config=InferenceConfig(),
+                                       model_dir=os.path.join(os.getcwd(), "models"))
+        self.model.load_weights(model_file, by_name=True)
+
+    def __call__(self, images):
+        # Pad the last, short batch with copies; their results are dropped
+        padded = list(images) + [images[0]] * (self.batch_size - len(images))
+        detections = self.model.detect(padded)[:len(images)]
+        results = []
+        for det in detections:
+            results.append({"lesions": [
+                {"label": mask_class_names[int(c)], "score": float(s),
+                 "box": [int(v) for v in box], "mask_pixels": int(det["masks"][..., i].sum())}
+                for i, (c, s, box) in enumerate(zip(det["class_ids"], det["scores"], det["rois"]))]})
+        return results
+
+
+# --- WORKER ---
+def work(db_path, task, batch_size, index):
+    """
+    One worker process: loads its models once, then claims batches until the
+    queue is empty. The next batch is read and decoded while the current one
+    runs through the model. Only the decoding runs on the loader threads; the
+    sqlite connection is used from this thread alone.
+    """
+    queue = JobQueue(db_path)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    models = []
+    if task in ("classify", "both"):
+        models.append(("classification", Classifier()))
+    if task in ("segment", "both"):
+        models.append(("segmentation", Segmenter(batch_size)))
+    print(f"👷 Worker {index} ({worker}) ready: {task}, batches of {batch_size}")
+
+    loader = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+    def fetch():
+        rows = queue.claim(batch_size, worker)
+        return rows, [loader.submit(load_image, row[1], row[2]) for row in rows]
+
+    done = 0
+    nxt = fetch()
+    while True:
+        rows, images = nxt
+        if not rows:
+            # Other workers' batches may still come back to the queue if
+            # they die: wait until they are finished or their leases expire
+            if not queue.leased():
+                break
+            time.sleep(LEASE_POLL_SECONDS)
+            nxt = fetch()
+            continue
+        nxt = fetch()
+        batch = []
+        for row, img in zip(rows, (f.result() for f in images)):
+            if img is None:
+                queue.fail(row[0], f"could not read image {row[1] or '(bytes)'}")
+            else:
+                batch.append((row[0], img))
+        if not batch:
+            continue
+        results = [{} for _ in batch]
+        try:
+            for name, model in models:
+                for result, out in zip(results, model([img for _, img in batch])):
+                    result[name] = out
+        except Exception as e:
+            for job_id, _ in batch:
+                queue.fail(job_id, repr(e))
+            print(f"❌ Worker {index}: batch failed: {e!r}")
+            continue
+        queue.complete([(job_id, result) for (job_id, _), result in zip(batch, results)])
+        done += len(batch)
+    loader.shutdown()
+    print(f"✅ Worker {index} finished: {done} jobs")
+
+
+def run_workers(db_path, task, batch_size, workers):
+    start = time.time()
+    queue = JobQueue(db_path)
+    before = queue.counts().get("done", 0)
+    requeued = queue.requeue_dead()
+    if requeued:
+        print(f"♻️ {requeued} jobs left running by dead workers put back in the queue")
+    if workers == 1:
+        work(db_path, task, batch_size, 0)
+    else:
+        # spawn: TensorFlow does not survive fork
+        ctx = multiprocessing.get_context("spawn")
+        procs = [ctx.Process(target=work, args=(db_path, task, batch_size, i)) for i in range(workers)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+    done = JobQueue(db_path).counts().get("done", 0) - before
+    elapsed = time.time() - start
+    print(f"📊 {done} jobs in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.1f} images/s)")
+
+
+# --- COMMAND LINE ---
+def iter_images(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for fname in sorted(files):
+                    if fname.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, fname)
+        else:
+            yield path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Durable batch inference over many images.")
+    parser.add_argument("--db", default=DB_FILE, help="queue database file")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("enqueue", help="queue images or directories of images")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--priority", type=int, default=0, help="higher runs first")
+
+    p = sub.add_parser("work", help="run workers until the queue is empty")
+    p.add_argument("--task", choices=sorted(BATCH_SIZES), default="classify")
+    p.add_argument("--batch", type=int, help="images per model call")
+    p.add_argument("--workers", type=int, default=1, help="worker processes")
+
+    sub.add_parser("status", help="job counts by state")
+
+    p = sub.add_parser("results", help="write results as CSV")
+    p.add_argument("--csv", help="output file (default: stdout)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "enqueue":
+        queue = JobQueue(args.db)
+        added = skipped = 0
+        queue.db.execute("BEGIN")
+        for path in iter_images(args.paths):
+            if queue.enqueue(path, priority=args.priority)[1]:
+                added += 1
+            else:
+                skipped += 1
+        queue.db.execute("COMMIT")
+        print(f"📥 {added} jobs queued, {skipped} already in the queue")
+    elif args.command == "work":
+        run_workers(args.db, args.task, args.batch or BATCH_SIZES[args.task], args.workers)
+    elif args.command == "status":
+        queue = JobQueue(args.db)
+        print(json.dumps({"pending": queue.pending(), "leased": queue.leased(), **queue.counts()}))
+    elif args.command == "results":
+        out = open(args.csv, "w", newline="") if args.csv else sys.stdout
+        writer = csv.writer(out)
+        writer.writerow(["id", "hash", "path", "state", "label", "confidence", "lesions", "error"])
+        for job_id, digest, path, state, result, error in JobQueue(args.db).results():
+            result = json.loads(result) if result else {}
+            cls = result.get("classification", {})
+            seg = result.get("segmentation", {})
+            writer.writerow([job_id, digest, path, state, cls.get("label"), cls.get("confidence"),
+                             len(seg["lesions"]) if seg else None, error])
+        if args.csv:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for job_queue.py that need no trained model: the classifier is
+replaced by a fake that labels images by their mean brightness.
+
+    python -m pytest test_job_queue.py
+"""
+
+import os
+import socket
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+import job_queue
+
+
+class FakeClassifier:
+    batches = []
+
+    def __init__(self, model_file=None):
+        pass
+
+    def __call__(self, images):
+        FakeClassifier.batches.append(len(images))
+        return [{"label": "benign" if img.mean() > 127 else "malignant"} for img in images]
+
+
+@pytest.fixture
+def queue_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "Classifier", FakeClassifier)
+    FakeClassifier.batches = []
+    return str(tmp_path / "jobs.sqlite3")
+
+
+def write_images(folder, values):
+    os.makedirs(folder)
+    for i, value in enumerate(values):
+        cv2.imwrite(os.path.join(folder, f"{i:02d}.png"), np.full((32, 32, 3), value, np.uint8))
+
+
+def test_work_end_to_end(queue_db, tmp_path):
+    images = str(tmp_path / "images")
+    write_images(images, [0, 255, 10, 250, 20])
+    job_queue.main(["--db", queue_db, "enqueue", images])
+    # Same image bytes again, an undecodable upload and an empty one
+    queue = job_queue.JobQueue(queue_db)
+    assert not queue.enqueue(os.path.join(images, "00.png"))[1]
+    queue.enqueue(data=b"not an image")
+    queue.enqueue(data=b"")
+
+    job_queue.main(["--db", queue_db, "work", "--batch", "2"])
+
+    assert FakeClassifier.batches == [2, 2, 1]
+    rows = {row[2] and os.path.basename(row[2]): row for row in queue.results()}
+    assert rows["00.png"][3] == "done"
+    assert '"malignant"' in rows["00.png"][4]
+    assert '"benign"' in rows["01.png"][4]
+    # Unreadable images are retried MAX_ATTEMPTS times, then given up on
+    assert queue.counts() == {"done": 5, "failed": 2}
+    assert [row[5] for row in queue.results() if row[3] == "failed"] == \
+        ["could not read image (bytes)"] * 2
+    assert queue.pending() == 0
+
+
+def test_expired_lease_counts_as_an_attempt(queue_db, monkeypatch):
+    queue = job_queue.JobQueue(queue_db)
+    job_id, _ = queue.enqueue(data=b"crashes the worker")
+    now = [1000.0]
+    monkeypatch.setattr(job_queue.time, "time", lambda: now[0])
+    for _ in range(job_queue.MAX_ATTEMPTS):
+        assert [row[0] for row in queue.claim(8, "w")] == [job_id]
+        now[0] += job_queue.LEASE_SECONDS + 1   # the worker died holding it
+    assert queue.pending() == 0
+    assert queue.claim(8, "w") == []
+    assert queue.counts() == {"failed": 1}
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def test_restart_requeues_jobs_of_dead_workers(queue_db):
+    queue = job_queue.JobQueue(queue_db)
+    for i in range(6):
+        queue.enqueue(data=cv2.imencode(".png", np.full((8, 8, 3), i, np.uint8))[1].tobytes())
+    # A worker on this host claimed four jobs and was killed
+    queue.claim(4, f"{socket.gethostname()}:{dead_pid()}")
+
+    job_queue.main(["--db", queue_db, "work", "--batch", "4"])
+
+    assert queue.counts() == {"done": 6}
+    assert queue.pending() == 0
+
+
+def test_work_waits_for_other_workers_leases(queue_db, monkeypatch):
+    monkeypatch.setattr(job_queue, "LEASE_SECONDS", 0.3)
+    monkeypatch.setattr(job_queue, "LEASE_POLL_SECONDS", 0.05)
+    queue = job_queue.JobQueue(queue_db)
+    queue.enqueue(data=cv2.imencode(".png", np.zeros((8, 8, 3), np.uint8))[1].tobytes())
+    queue.claim(1, "otherhost:1")   # alive as far as we can tell
+    assert queue.pending() == 1 and queue.leased() == 1
+
+    job_queue.work(queue_db, "classify", 4, 0)
+
+    assert queue.counts() == {"done": 1}
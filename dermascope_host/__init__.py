@@ -0,0 +1,4 @@
+"""Host-side tools for the DermaScope camera.
+
+Everything under DermaScope/ runs on the Pico W; this package runs on a PC.
+"""
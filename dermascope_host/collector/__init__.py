@@ -0,0 +1,26 @@
+"""Asyncio receiver for a fleet of DermaScope devices.
+
+One event loop holds a connection per device; frames are read with
+``recv_into`` into per-connection buffers, CRC-checked, decoded with
+``cv2.imdecode`` from those buffers and handed to inference through a
+bounded queue::
+
+    from dermascope_host.collector import Collector
+
+    async def main():
+        async with Collector(['192.168.4.1', 'clinic-2:4242']) as collector:
+            await collector.command('CAPTURE 5')
+            async for frame in collector.frames():
+                classify(frame.image)
+
+or from the command line::
+
+    python -m dermascope_host.collector 192.168.4.1 clinic-2:4242 --capture 5
+
+Decoding needs ``opencv-python`` and ``numpy``; with ``decode=False`` the
+collector runs on the standard library alone.
+"""
+from dermascope_host.collector.device import Device, Message
+from dermascope_host.collector.fleet import Collector, Frame
+
+__all__ = ['Collector', 'Device', 'Frame', 'Message']
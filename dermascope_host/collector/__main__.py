@@ -0,0 +1,52 @@
+"""Collect frames from DermaScope devices and report them as they arrive."""
+import argparse
+import asyncio
+import logging
+import time
+
+from dermascope_host.collector import Collector
+
+
+async def collect(args):
+    collector = Collector(args.devices, queue_size=args.queue, decode=not args.no_decode)
+    async with collector:
+        if args.capture:
+            await collector.command('CAPTURE %d' % args.capture)
+        t0 = time.monotonic()
+        count = 0
+        total = 0
+        async for frame in collector.frames():
+            count += 1
+            total += frame.size
+            print('%.3f %s frame %d: %d bytes%s' % (
+                frame.received - t0, frame.device.name, frame.frame_id, frame.size,
+                '' if frame.image is None else ' %dx%d' % frame.image.shape[1::-1]))
+            if args.count and count >= args.count:
+                break
+        elapsed = time.monotonic() - t0
+        print('%d frames, %d bytes in %.2f s: %.2f frames/s, %.1f kB/s'
+              % (count, total, elapsed, count / elapsed, total / elapsed / 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m dermascope_host.collector',
+                                     description=__doc__)
+    parser.add_argument('devices', nargs='+', metavar='HOST[:PORT]')
+    parser.add_argument('--capture', type=int, default=0,
+                        help='ask every device for this many captures on connect')
+    parser.add_argument('--count', type=int, default=0,
+                        help='stop after this many frames in total')
+    parser.add_argument('--queue', type=int, default=32, help='frames buffered for inference')
+    parser.add_argument('--no-decode', action='store_true', help='skip JPEG decoding')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(name)s %(message)s')
+    try:
+        asyncio.run(collect(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
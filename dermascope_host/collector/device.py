@@ -0,0 +1,171 @@
+"""One DermaScope connection: wire-format messages read with ``recv_into``
+straight into buffers that live as long as the connection."""
+import asyncio
+import json
+import logging
+import socket
+
+from dermascope_host import wire
+
+log = logging.getLogger(__name__)
+
+PORT = 4242
+INITIAL_PAYLOAD = 1 << 20  # grows to the largest frame seen, then stays
+RECONNECT_MIN_S = 0.5
+RECONNECT_MAX_S = 30.0
+
+
+def parse_address(address):
+    """``'host'`` or ``'host:port'`` -> (host, port)."""
+    host, _, port = address.rpartition(':') if ':' in address else (address, '', '')
+    return host, int(port) if port else PORT
+
+
+class Message:
+    """One received message. For frames, ``payload`` is a view into the
+    device's receive buffer: valid only until the device reads the next one."""
+
+    __slots__ = ('kind', 'flags', 'frame_id', 'timestamp_ms', 'mode', 'meta',
+                 'offset', 'payload')
+
+    def __init__(self, header, meta, payload):
+        self.kind = header['kind']
+        self.flags = header['flags']
+        self.frame_id = header['frame_id']
+        self.timestamp_ms = header['timestamp_ms']
+        self.mode = header['mode']
+        self.offset = header['offset']
+        self.meta = meta
+        self.payload = payload
+
+
+class Device:
+    """A connection to one device, reconnecting with backoff until stopped.
+
+    All reads go through ``loop.sock_recv_into`` into the header, chunk
+    prefix, metadata and payload buffers allocated here, so a steady stream
+    of frames costs no per-frame allocations on the receive path.
+    """
+
+    def __init__(self, address):
+        self.host, self.port = parse_address(address)
+        self.name = '%s:%d' % (self.host, self.port)
+        self.sock = None
+        self.connected = asyncio.Event()
+        self.frames = 0
+        self.bytes = 0
+        self._header = bytearray(wire.HEADER.size)
+        self._chunk = bytearray(wire.CHUNK.size)
+        self._meta = bytearray(0xFFFF)
+        self._payload = bytearray(INITIAL_PAYLOAD)
+
+    def __repr__(self):
+        return '<Device %s>' % self.name
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        family, type_, proto, _, addr = infos[0]
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            await loop.sock_connect(sock, addr)
+        except BaseException:
+            sock.close()
+            raise
+        self.sock = sock
+        self.connected.set()
+
+    def close(self):
+        self.connected.clear()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    async def command(self, line):
+        """Send one command line, e.g. ``'CAPTURE 3'``; the reply arrives as a
+        KIND_MSG message."""
+        await self.connected.wait()
+        await asyncio.get_running_loop().sock_sendall(self.sock, line.encode() + b'\n')
+
+    async def _recv_exact(self, view):
+        loop = asyncio.get_running_loop()
+        got = 0
+        n = len(view)
+        while got < n:
+            k = await loop.sock_recv_into(self.sock, view[got:])
+            if not k:
+                raise ConnectionError('%s closed the connection' % self.name)
+            got += k
+
+    def _reserve(self, size):
+        # Grow the payload buffer, keeping what this frame already holds
+        if size > len(self._payload):
+            grown = bytearray(max(size, 2 * len(self._payload)))
+            grown[:len(self._payload)] = self._payload
+            self._payload = grown
+
+    async def read_message(self):
+        """Read the next message, checking every chunk's CRC.
+
+        Resumed frames (sent after a RESUME command) are rejected: the start
+        of such a frame is not in the buffer, so the connection is restarted.
+        """
+        await self._recv_exact(memoryview(self._header))
+        header = wire.unpack_header(self._header)
+        if header['flags'] & wire.FLAG_RESUMED:
+            raise wire.ProtocolError('%s: unexpected resumed frame %d'
+                                     % (self.name, header['frame_id']))
+        meta = {}
+        if header['meta_len']:
+            view = memoryview(self._meta)[:header['meta_len']]
+            await self._recv_exact(view)
+            try:
+                meta = json.loads(bytes(view))
+            except ValueError as e:
+                raise wire.ProtocolError('%s: bad metadata: %s' % (self.name, e))
+        pos = 0
+        self._reserve(header['payload_len'])
+        while True:
+            await self._recv_exact(memoryview(self._chunk))
+            size, crc = wire.CHUNK.unpack(self._chunk)
+            if not size:
+                if crc != pos:
+                    raise wire.ProtocolError('%s: terminator says %d bytes, got %d'
+                                             % (self.name, crc, pos))
+                break
+            self._reserve(pos + size)
+            view = memoryview(self._payload)[pos:pos + size]
+            await self._recv_exact(view)
+            if wire.crc32(view) != crc:
+                raise wire.ProtocolError('%s: CRC mismatch in frame %d at byte %d'
+                                         % (self.name, header['frame_id'], pos))
+            pos += size
+        self.bytes += pos
+        return Message(header, meta, memoryview(self._payload)[:pos])
+
+    async def run(self, handle):
+        """Receive forever, awaiting ``handle(device, message)`` for each
+        message before reading the next one, so a slow handler pushes back
+        on the device through TCP flow control."""
+        delay = RECONNECT_MIN_S
+        while True:
+            try:
+                await self.connect()
+                log.info('%s connected', self.name)
+                delay = RECONNECT_MIN_S
+                while True:
+                    message = await self.read_message()
+                    if message.kind == wire.KIND_FRAME:
+                        self.frames += 1
+                    await handle(self, message)
+            except (OSError, wire.ProtocolError) as e:
+                log.warning('%s: %s; reconnecting in %.1f s', self.name, e, delay)
+            except Exception:
+                # A bug here or in the handler: keep the device, not the task, down
+                log.exception('%s: unexpected error; reconnecting in %.1f s', self.name, delay)
+            finally:
+                self.close()
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, RECONNECT_MAX_S)
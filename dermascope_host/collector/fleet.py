@@ -0,0 +1,138 @@
+"""Many devices on one event loop, feeding a bounded queue of decoded frames."""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import time
+
+from dermascope_host import wire
+from dermascope_host.collector.device import Device
+
+log = logging.getLogger(__name__)
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # decode=False still works without OpenCV
+    cv2 = np = None
+
+
+class Frame:
+    """A frame ready for inference.
+
+    ``image`` is the decoded BGR array (None with ``decode=False`` or if the
+    JPEG did not decode); ``jpeg`` holds a copy of the encoded bytes only
+    when the collector was asked to keep them.
+    """
+
+    __slots__ = ('device', 'frame_id', 'timestamp_ms', 'mode', 'meta', 'size',
+                 'image', 'jpeg', 'received')
+
+    def __init__(self, device, message, image, jpeg):
+        self.device = device
+        self.frame_id = message.frame_id
+        self.timestamp_ms = message.timestamp_ms
+        self.mode = message.mode
+        self.meta = message.meta
+        self.size = len(message.payload)
+        self.image = image
+        self.jpeg = jpeg
+        self.received = time.monotonic()
+
+    def __repr__(self):
+        shape = None if self.image is None else self.image.shape
+        return '<Frame %s #%d %s %d bytes %s>' % (self.device.name, self.frame_id,
+                                                 wire.MODE_NAMES.get(self.mode, self.mode),
+                                                 self.size, shape)
+
+
+def decode_jpeg(payload):
+    # Decodes straight from the receive buffer: np.frombuffer is a view
+    if not len(payload):
+        return None  # imdecode raises on an empty buffer
+    return cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+
+
+class Collector:
+    """Receive from every device in ``addresses`` concurrently.
+
+    Frames go into ``queue`` (an ``asyncio.Queue`` of :class:`Frame`). When
+    it is full, a device's reader waits and its socket stops being drained,
+    so memory stays bounded however slow inference is. The device skips
+    live preview frames for a client that is behind. If a write still can't
+    go through within its send timeout (2 s), the device drops the
+    connection. The collector then reconnects, and captures that weren't
+    delivered reach it from the device's flash queue.
+
+    JPEGs are decoded by a thread pool shared by all devices (OpenCV
+    releases the GIL while decoding), directly from each device's receive
+    buffer; a device reads its next message only once the last one is
+    decoded. Previews are passed through like any other frame; filter on
+    ``frame.mode`` downstream if they are not wanted.
+
+    ``on_message(device, meta)`` is called for command replies and errors.
+    """
+
+    def __init__(self, addresses, queue_size=32, decode=True, keep_jpeg=False,
+                 decode_workers=None, on_message=None):
+        if decode and cv2 is None:
+            raise ImportError('decoding needs opencv-python and numpy; use decode=False')
+        self.devices = [Device(a) for a in addresses]
+        self.queue = asyncio.Queue(queue_size)
+        self.decode = decode
+        self.keep_jpeg = keep_jpeg
+        self.on_message = on_message or self._log_message
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=decode_workers or os.cpu_count() or 1,
+            thread_name_prefix='jpeg-decode') if decode else None
+        self._tasks = []
+
+    @staticmethod
+    def _log_message(device, meta):
+        log.info('%s: %s', device.name, meta)
+
+    async def _handle(self, device, message):
+        if message.kind != wire.KIND_FRAME:
+            self.on_message(device, message.meta)
+            return
+        image = None
+        if self.decode:
+            loop = asyncio.get_running_loop()
+            image = await loop.run_in_executor(self._pool, decode_jpeg, message.payload)
+            if image is None:
+                log.warning('%s: frame %d did not decode', device.name, message.frame_id)
+        jpeg = bytes(message.payload) if self.keep_jpeg else None
+        await self.queue.put(Frame(device, message, image, jpeg))
+
+    def start(self):
+        """Start a receive task per device on the running loop."""
+        self._tasks = [asyncio.create_task(d.run(self._handle), name='dermascope %s' % d.name)
+                       for d in self.devices]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def command(self, line):
+        """Send a command line to every device."""
+        await asyncio.gather(*[d.command(line) for d in self.devices])
+
+    async def frames(self):
+        """Iterate over frames as they arrive, marking each one done."""
+        while True:
+            frame = await self.queue.get()
+            try:
+                yield frame
+            finally:
+                self.queue.task_done()
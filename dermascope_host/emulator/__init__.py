@@ -0,0 +1,27 @@
+"""CPython emulator of the DermaScope board.
+
+Runs DermaScope/main.py unmodified on a PC: fake ``machine``, ``network``,
+``utime``, ``uasyncio`` and ``micropython`` modules sit in front of a
+:class:`Board` that models the Arducam's SPI registers and FIFO, the OV5642's
+I2C registers, and the bus, sensor and Wi-Fi timing of the real hardware.
+The firmware's TCP ports come up on localhost, so host tools can treat the
+emulator as a device::
+
+    python -m dermascope_host.emulator --jpeg sample.jpg
+    python -m dermascope_host.emulator.bench --captures 20
+
+or from Python::
+
+    from dermascope_host.emulator import Board, run_firmware, wait_ready
+    board = Board(jpeg='sample.jpg', spi_max_hz=8_000_000)
+    run_firmware(board)
+    wait_ready()
+    board.press()  # the capture button
+
+The fake modules are installed process-wide and the firmware changes the
+working directory to its flash directory, so run one emulator per process.
+"""
+from dermascope_host.emulator.board import Board
+from dermascope_host.emulator.runtime import install, run_firmware, wait_ready
+
+__all__ = ['Board', 'install', 'run_firmware', 'wait_ready']
@@ -0,0 +1,36 @@
+"""Run the firmware on an emulated board as a local device stand-in."""
+import argparse
+import sys
+import threading
+import time
+
+from dermascope_host.emulator.runtime import add_board_arguments, make_board, run_firmware
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m dermascope_host.emulator',
+                                     description=__doc__)
+    add_board_arguments(parser)
+    parser.add_argument('--press-every', type=float, metavar='SECONDS',
+                        help='press the capture button periodically')
+    args = parser.parse_args()
+    board = make_board(args)
+
+    if args.press_every:
+        def presser():
+            while True:
+                time.sleep(args.press_every)
+                board.press()
+        threading.Thread(target=presser, daemon=True).start()
+
+    thread = run_firmware(board, args.firmware, args.flash)
+    if board.usb_port:
+        print('USB CDC port:', board.usb_port, file=sys.stderr)
+    try:
+        thread.join()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""End-to-end throughput run: boot the firmware on an emulated board, ask it
+for captures over TCP and time every frame that comes back.
+
+    python -m dermascope_host.emulator.bench --captures 20 --mode capture
+"""
+import argparse
+import json
+import socket
+import struct
+import time
+
+from dermascope_host.emulator.runtime import (add_board_arguments, make_board,
+                                              run_firmware, wait_ready)
+
+
+def recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:])
+        if not k:
+            raise ConnectionError('device closed the connection')
+        got += k
+    return buf
+
+
+def read_message(sock, framing):
+    """Read one wire-format message; returns (header fields, meta, payload)."""
+    fields = struct.unpack(framing.HEADER, recv_exact(sock, framing.HEADER_SIZE))
+    if fields[0] != framing.MAGIC or fields[1] != framing.VERSION:
+        raise ValueError('bad header %r' % (fields[:2],))
+    meta = json.loads(bytes(recv_exact(sock, fields[11]))) if fields[11] else {}
+    payload = bytearray()
+    while True:
+        size, crc = struct.unpack(framing.CHUNK, recv_exact(sock, framing.CHUNK_SIZE))
+        if not size:
+            if crc != len(payload):
+                raise ValueError('terminator says %d bytes, got %d' % (crc, len(payload)))
+            return fields, meta, payload
+        data = recv_exact(sock, size)
+        if framing.crc32(data) != crc:
+            raise ValueError('CRC mismatch in frame %d at byte %d' % (fields[4], len(payload)))
+        payload += data
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m dermascope_host.emulator.bench',
+                                     description=__doc__)
+    add_board_arguments(parser)
+    parser.add_argument('--captures', type=int, default=10)
+    parser.add_argument('--mode', choices=('capture', 'preview'), default='capture')
+    parser.add_argument('--port', type=int, default=4242)
+    args = parser.parse_args()
+
+    board = make_board(args)
+    run_firmware(board, args.firmware, args.flash)
+    wait_ready(args.port)
+    import framing  # the firmware's copy, on sys.path once it is loaded
+
+    sock = socket.create_connection(('127.0.0.1', args.port))
+    sock.sendall(b'MODE %s\n' % args.mode.upper().encode())
+    while True:
+        fields, meta, _ = read_message(sock, framing)
+        if meta.get('cmd') == 'mode':
+            last_id = meta['frames'] + args.captures
+            break
+    sock.sendall(b'CAPTURE %d\n' % args.captures)
+    t0 = time.monotonic()
+    frames = 0
+    total = 0
+    frame_id = 0
+    while frame_id < last_id:
+        fields, meta, payload = read_message(sock, framing)
+        if fields[2] != framing.KIND_FRAME:
+            if 'error' in meta:
+                raise SystemExit('device error: %s' % meta)
+            continue
+        frame_id = fields[4]
+        frames += 1
+        total += len(payload)
+        t = time.monotonic() - t0
+        print('frame %d: %d bytes q=%s at %.3f s' % (frame_id, len(payload), meta.get('q'), t))
+    elapsed = time.monotonic() - t0
+    print('%d of %d frames received, %d bytes in %.2f s: '
+          '%.2f frames/s, %.1f kB/s' % (frames, args.captures, total, elapsed,
+                                        frames / elapsed, total / elapsed / 1000))
+    print('SPI %d bytes, %d bit errors; %d I2C transactions'
+          % (board.spi_bytes, board.spi_errors, board.i2c_transactions))
+
+    sock.sendall(b'STATS\n')
+    while True:
+        fields, meta, _ = read_message(sock, framing)
+        if meta.get('cmd') == 'stats':
+            for name, summary in meta.items():
+                if name != 'cmd':
+                    print('%-9s %s' % (name, summary))
+            break
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""Simulated Pico W + Arducam Mini 5MP Plus (ArduChip SPI bridge and OV5642).
+
+The board owns all hardware state shared by the fake ``machine`` and
+``network`` modules: GPIO levels and IRQ handlers, the ArduChip register
+file and frame FIFO, the OV5642 register file, and a bus clock that makes
+every SPI and I2C transaction take as long as it would on the wire.
+"""
+import errno
+import os
+import random
+import threading
+import time
+
+# ArduChip SPI registers (see DermaScope/main.py)
+REG_TEST = 0x00
+REG_FRAMES = 0x01
+REG_TIM = 0x03
+REG_FIFO = 0x04
+REG_RESET = 0x07
+REG_VERSION = 0x40
+REG_TRIG = 0x41
+REG_FIFO_SIZE1 = 0x42
+REG_FIFO_SIZE2 = 0x43
+REG_FIFO_SIZE3 = 0x44
+CMD_BURST_READ = 0x3C
+CMD_SINGLE_READ = 0x3D
+
+FIFO_CLEAR = 0x01
+FIFO_START = 0x02
+FIFO_RDPTR_RST = 0x10
+FIFO_WRPTR_RST = 0x20
+CAP_DONE = 0x08
+FIFO_MAX = 0x7FFFFF  # 8 MB frame buffer, 23-bit length
+
+# OV5642 SCCB registers
+SENSOR_ADDR = 0x3C
+SENSOR_RESET = 0x3008
+CHIP_ID = {0x300A: 0x56, 0x300B: 0x42}
+WINDOW_WIDTH = 0x3804  # 16-bit, big-endian: sensor array window
+OUT_WIDTH = 0x3808   # 16-bit, big-endian
+OUT_HEIGHT = 0x380A  # 16-bit, big-endian
+JPEG_QS = 0x4407
+AEC_AVG = 0x56A1     # average luma readout
+AEC_WPT = 0x3A0F     # AEC stable range, upper limit
+AEC_BPT = 0x3A10     # AEC stable range, lower limit
+AWB_GAIN = 0x3400    # R, G, B gains, 16-bit big-endian each
+
+PERI_HZ = 125_000_000  # rp2 peripheral clock the SPI divider works from
+
+
+class BusClock:
+    """Charge simulated bus time to the calling thread.
+
+    Transactions are far shorter than the host's sleep granularity, so time
+    is accumulated against a deadline and only slept off once it adds up;
+    the average rate is exact and the latency error stays under ``slack``.
+    """
+
+    def __init__(self, slack=0.0005):
+        self.slack = slack
+        self.due = 0.0
+        self.busy = 0.0  # total simulated bus seconds
+        self.enabled = True
+
+    def spend(self, seconds):
+        self.busy += seconds
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.due = max(self.due, now) + seconds
+        if self.due - now > self.slack:
+            time.sleep(self.due - now)
+
+
+class Board:
+    """Hardware model behind the fake ``machine``/``network`` modules.
+
+    jpeg / preview_jpeg
+        Bytes or a file path served from the FIFO. ``preview_jpeg`` is used
+        when the sensor output is 640 pixels wide or less and falls back to
+        ``jpeg``. Without either, each capture is a synthetic JPEG-shaped
+        blob (SOI, marker-free filler, EOI) whose size follows the output
+        resolution and quantization scale, like the real encoder's does.
+    spi_max_hz
+        Fastest SCLK the ArduChip reads reliably. Faster clocks still work
+        but flip bits in returned data, as a marginal bus would.
+    i2c_max_hz
+        SCCB clock the sensor can follow; faster requests are clock-stretched.
+    spi_overhead_us / i2c_overhead_us
+        Fixed cost of one bus transaction (CS toggles, start/stop, and the
+        MicroPython call overhead on the Pico).
+    full_frame_ms / preview_frame_ms
+        Sensor frame period. A capture waits for the next frame start and then
+        takes one frame period per frame.
+    ae_settle_ms
+        Time after a sensor reset for the average luma to reach the AEC
+        stable range and the AWB gains to stop moving.
+    ap_up_ms
+        Time from activating the AP interface until it reports active.
+    link_bps
+        Wi-Fi throughput shared by all TCP clients, 0 for unthrottled.
+    usb / usb_bps
+        Boot on USB power (VBUS high) with the CDC port exposed as a
+        pseudo-terminal, and its throughput.
+    tcp_sndbuf
+        Per-socket send buffer, matching lwIP's small TCP window.
+    flash_bytes
+        Size of the filesystem ``os.statvfs`` reports, counting what is in the
+        flash directory in 4 KB blocks; None reports the host's own.
+    realtime
+        When False, bus and exposure time are accounted but not slept.
+    """
+
+    def __init__(self, jpeg=None, preview_jpeg=None, spi_max_hz=8_000_000,
+                 i2c_max_hz=400_000, spi_overhead_us=10, i2c_overhead_us=40,
+                 full_frame_ms=133, preview_frame_ms=33, sensor_reset_ms=1,
+                 ae_settle_ms=400, ap_up_ms=300,
+                 bytes_per_pixel=0.12, fifo_pad=8, link_bps=12_000_000,
+                 tcp_sndbuf=11680, wifi_connect_ms=1500, usb=False, usb_bps=8_000_000,
+                 flash_bytes=None, realtime=True, seed=None):
+        self.jpeg = _load(jpeg)
+        self.preview_jpeg = _load(preview_jpeg)
+        self.spi_max_hz = spi_max_hz
+        self.i2c_max_hz = i2c_max_hz
+        self.spi_overhead = spi_overhead_us / 1e6
+        self.i2c_overhead = i2c_overhead_us / 1e6
+        self.full_frame_ms = full_frame_ms
+        self.preview_frame_ms = preview_frame_ms
+        self.sensor_reset_ms = sensor_reset_ms
+        self.ae_settle_ms = ae_settle_ms
+        self.ap_up_ms = ap_up_ms
+        self.bytes_per_pixel = bytes_per_pixel
+        self.fifo_pad = fifo_pad
+        self.link_bps = link_bps
+        self.tcp_sndbuf = tcp_sndbuf
+        self.wifi_connect_ms = wifi_connect_ms
+        self.usb = usb
+        self.usb_bps = usb_bps
+        self.usb_port = None  # pty path, set when the firmware starts
+        self.flash_bytes = flash_bytes
+        self.rng = random.Random(seed)
+        self.clock = BusClock()
+        self.clock.enabled = realtime
+        self.lock = threading.RLock()
+
+        # GPIO
+        self.levels = {'WL_GPIO2': int(usb)}  # VBUS sense
+        self.pins = {}                 # id -> [fake machine.Pin]
+        self.cs_pin = 5
+
+        # ArduChip
+        self.chip = {REG_VERSION: 0x73}
+        self.selected = False
+        self.cmd = None
+        self.fifo = b''
+        self.fifo_len = 0
+        self.rd = 0
+        self.done_at = None  # perf_counter time CAP_DONE goes high
+        self.captures = 0
+
+        # OV5642
+        self.sensor = {}
+        self.sensor_ptr = 0
+        self.sensor_busy_until = 0.0
+        self.sensor_reset_at = time.perf_counter()
+        self.i2c_transactions = 0
+
+        # Counters for tests
+        self.spi_bytes = 0
+        self.spi_errors = 0
+        self.sleep_ms = 0
+
+    # ----------------- GPIO -----------------
+    def attach(self, pin):
+        self.pins.setdefault(pin.id, []).append(pin)
+
+    def level(self, pin_id, default=0):
+        return self.levels.get(pin_id, default)
+
+    def drive(self, pin_id, value):
+        # Set an input level from outside (a button, VBUS) and fire pin IRQs
+        old = self.levels.get(pin_id, 0)
+        self.levels[pin_id] = value
+        if old != value:
+            for pin in self.pins.get(pin_id, ()):
+                pin._edge(value)
+
+    def output(self, pin_id, value):
+        # A pin driven by the firmware
+        self.levels[pin_id] = value
+        if pin_id == self.cs_pin:
+            with self.lock:
+                self.selected = not value
+                self.cmd = None
+
+    def press(self, pin_id=15, hold_ms=80, bounce=3):
+        # Press and release a pull-up button in the background, with contact
+        # bounce on both edges
+        def run():
+            for level in (0, 1):
+                for _ in range(bounce):
+                    self.drive(pin_id, level)
+                    time.sleep(0.0005)
+                    self.drive(pin_id, 1 - level)
+                    time.sleep(0.0005)
+                self.drive(pin_id, level)
+                if level == 0:
+                    time.sleep(hold_ms / 1000)
+        threading.Thread(target=run, daemon=True).start()
+
+    # ----------------- SPI (ArduChip) -----------------
+    def spi_write(self, data, baud):
+        self._spi_time(len(data), baud)
+        if not self.selected:
+            return
+        with self.lock:
+            for b in data:
+                if self.cmd is None:
+                    self.cmd = b
+                elif self.cmd & 0x80:
+                    self._chip_write(self.cmd & 0x7F, b)
+                    self.cmd = 0x7F  # further bytes in this transaction are ignored
+
+    def spi_readinto(self, mv, baud):
+        n = len(mv)
+        self._spi_time(n, baud)
+        if not self.selected or self.cmd is None:
+            mv[:] = b'\xff' * n  # MISO floats high
+            return
+        with self.lock:
+            if self.cmd in (CMD_BURST_READ, CMD_SINGLE_READ):
+                data = self.fifo[self.rd:self.rd + n]
+                self.rd += n
+                mv[:len(data)] = data
+                if len(data) < n:
+                    mv[len(data):] = bytes(n - len(data))
+            else:
+                mv[0] = self._chip_read(self.cmd & 0x7F)
+                if n > 1:
+                    mv[1:] = bytes(n - 1)
+        if baud > self.spi_max_hz:
+            self._corrupt(mv, baud)
+
+    def spi_baud(self, requested):
+        # The rp2 SPI divider only reaches PERI_HZ / (even prescale * rate)
+        div = max(2, -(-PERI_HZ // max(1, requested)))
+        div += div & 1
+        return PERI_HZ // div
+
+    def _spi_time(self, n, baud):
+        self.spi_bytes += n
+        self.clock.spend(self.spi_overhead + n * 8 / baud)
+
+    def _corrupt(self, mv, baud):
+        # Past the ArduChip's limit, sampling drifts into the next bit
+        p = min(1.0, (baud / self.spi_max_hz - 1) * 0.02)
+        for i in range(len(mv)):
+            if self.rng.random() < p:
+                mv[i] ^= 1 << self.rng.randrange(8)
+                self.spi_errors += 1
+
+    def _chip_write(self, reg, value):
+        if reg == REG_FIFO:
+            if value & FIFO_CLEAR:
+                self.done_at = None
+                self.fifo_len = 0
+            if value & FIFO_START:
+                self._start_capture()
+            if value & FIFO_RDPTR_RST:
+                self.rd = 0
+            if value & FIFO_WRPTR_RST:
+                self.fifo_len = 0
+        else:
+            self.chip[reg] = value
+
+    def _chip_read(self, reg):
+        done = self.done_at is not None and time.perf_counter() >= self.done_at
+        if reg == REG_TRIG:
+            return CAP_DONE if done else 0
+        n = self.fifo_len if done else 0
+        if reg == REG_FIFO_SIZE1:
+            return n & 0xFF
+        if reg == REG_FIFO_SIZE2:
+            return (n >> 8) & 0xFF
+        if reg == REG_FIFO_SIZE3:
+            return (n >> 16) & 0x7F
+        return self.chip.get(reg, 0)
+
+    # ----------------- Capture -----------------
+    def _sensor16(self, reg):
+        return (self.sensor.get(reg, 0) << 8) | self.sensor.get(reg + 1, 0)
+
+    def output_size(self):
+        return (self._sensor16(OUT_WIDTH) or 2592), (self._sensor16(OUT_HEIGHT) or 1944)
+
+    def _start_capture(self):
+        w, h = self.output_size()
+        # A scaled-down full window is the preview; a small 1:1 window is a
+        # crop of the full frame and reads out as fast as its rows allow
+        preview = w <= 640 and (self._sensor16(WINDOW_WIDTH) or 2592) > w
+        if preview:
+            period = self.preview_frame_ms / 1000
+        else:
+            period = max(self.full_frame_ms * h / 1944, self.preview_frame_ms) / 1000
+        count = (self.chip.get(REG_FRAMES, 0) & 0x07) + 1
+        frames = [self.jpeg_frame(w, h, preview) for _ in range(count)]
+        data = b''.join(f + bytes(self.fifo_pad) for f in frames)[:FIFO_MAX]
+        self.fifo = data
+        self.fifo_len = len(data)
+        self.rd = 0
+        self.captures += 1
+        # Wait for the next frame start, then expose and read out each frame
+        wait = period * self.rng.random() + period * count
+        self.done_at = time.perf_counter() + (wait if self.clock.enabled else 0)
+
+    def jpeg_frame(self, w, h, preview=False):
+        if preview and self.preview_jpeg:
+            return self.preview_jpeg
+        if self.jpeg:
+            return self.jpeg
+        qs = (self.sensor.get(JPEG_QS, 4) & 0x3F) or 1
+        size = int(w * h * self.bytes_per_pixel * 4 / qs * self.rng.uniform(0.9, 1.1))
+        body = bytes(self.rng.getrandbits(8) for _ in range(256)).replace(b'\xff', b'\xfe')
+        body = (body * (size // len(body) + 1))[:max(0, size - 4)]
+        return b'\xff\xd8' + body + b'\xff\xd9'
+
+    # ----------------- I2C (OV5642) -----------------
+    def i2c_write(self, addr, data, freq):
+        self._i2c_time(len(data), freq)
+        self._sensor_check(addr)
+        if len(data) < 2:
+            raise OSError(errno.EIO)
+        with self.lock:
+            reg = (data[0] << 8) | data[1]
+            for v in data[2:]:
+                if reg not in CHIP_ID:
+                    self.sensor[reg] = v
+                if reg == SENSOR_RESET and v & 0x80:
+                    self.sensor.clear()
+                    self.sensor_reset_at = time.perf_counter()
+                    self.sensor_busy_until = self.sensor_reset_at + self.sensor_reset_ms / 1000
+                reg += 1
+            self.sensor_ptr = reg if len(data) > 2 else (data[0] << 8) | data[1]
+
+    def i2c_read(self, addr, n, freq):
+        self._i2c_time(n, freq)
+        self._sensor_check(addr)
+        with self.lock:
+            out = bytearray(n)
+            for i in range(n):
+                reg = self.sensor_ptr + i
+                out[i] = CHIP_ID.get(reg, self._sensor_readout(reg))
+            self.sensor_ptr += n
+        return bytes(out)
+
+    def _sensor_readout(self, reg):
+        # AEC and AWB converge linearly from a sensor reset
+        if reg != AEC_AVG and not AWB_GAIN <= reg < AWB_GAIN + 6:
+            return self.sensor.get(reg, 0)
+        elapsed = time.perf_counter() - self.sensor_reset_at
+        f = min(1.0, elapsed * 1000 / self.ae_settle_ms) if self.ae_settle_ms else 1.0
+        if reg == AEC_AVG:
+            target = (self.sensor.get(AEC_WPT, 0x78) + self.sensor.get(AEC_BPT, 0x68)) // 2
+            return int(0x10 + (target - 0x10) * f)
+        gain = 0x400 + int((0x200, 0, 0x100)[(reg - AWB_GAIN) // 2] * (1 - f))
+        return (gain >> 8) & 0xFF if reg % 2 == 0 else gain & 0xFF
+
+    def _i2c_time(self, n, freq):
+        self.i2c_transactions += 1
+        hz = min(freq, self.i2c_max_hz)
+        self.clock.spend(self.i2c_overhead + (n + 1) * 9 / hz)
+
+    def _sensor_check(self, addr):
+        # No ACK from an absent device or a sensor still coming out of reset
+        if addr != SENSOR_ADDR or time.perf_counter() < self.sensor_busy_until:
+            raise OSError(errno.EIO)
+
+
+def _load(src):
+    if src is None or isinstance(src, (bytes, bytearray)):
+        return src
+    with open(os.fspath(src), 'rb') as f:
+        return f.read()
+
+
+current = None  # the Board the fake modules talk to; set by runtime.install
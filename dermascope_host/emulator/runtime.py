@@ -0,0 +1,120 @@
+"""Load the unmodified DermaScope firmware into CPython against a Board."""
+import io
+import os
+import runpy
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+from dermascope_host.emulator import board as _board
+
+STUBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs')
+FIRMWARE = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                         os.pardir, os.pardir, 'DermaScope'))
+FAKE_MODULES = ('machine', 'network', 'utime', 'uasyncio', 'micropython')
+
+
+def install(board):
+    """Make ``board`` the hardware behind the fake modules and put them on sys.path."""
+    _board.current = board
+    if STUBS not in sys.path:
+        sys.path.insert(0, STUBS)
+    for name in FAKE_MODULES:
+        sys.modules.pop(name, None)
+
+
+def run_firmware(board, firmware=FIRMWARE, flash=None, block=False):
+    """Run ``firmware``/main.py on ``board``.
+
+    ``flash`` is the directory that stands in for the Pico's filesystem and
+    becomes the process working directory; a temporary one is made if not
+    given. With ``block`` the firmware runs in the calling thread until it
+    exits; otherwise it starts in a daemon thread, which is returned.
+
+    A ``usb`` board gets a pseudo-terminal as its CDC port: it replaces this
+    process's stdin/stdout, and its path is in ``board.usb_port``.
+    """
+    install(board)
+    if board.usb:
+        attach_usb(board)
+    firmware = os.path.abspath(firmware)
+    if firmware not in sys.path:
+        sys.path.insert(1, firmware)
+    os.chdir(flash or tempfile.mkdtemp(prefix='dermascope-flash-'))
+    if board.flash_bytes:
+        os.statvfs = flash_statvfs(os.getcwd(), board.flash_bytes)
+    main = os.path.join(firmware, 'main.py')
+
+    def run():
+        runpy.run_path(main, run_name='__main__')
+
+    if block:
+        run()
+        return None
+    thread = threading.Thread(target=run, name='firmware', daemon=True)
+    thread.start()
+    return thread
+
+
+def flash_statvfs(root, size, block=4096):
+    """An ``os.statvfs`` for a ``size``-byte filesystem holding ``root``."""
+    def statvfs(path):
+        used = 0
+        for folder, _, files in os.walk(root):
+            for name in files:
+                used += -(-os.path.getsize(os.path.join(folder, name)) // block)
+        free = max(0, size // block - used)
+        # MicroPython's tuple: bsize, frsize, blocks, bfree, bavail, files, ffree, favail, flag, namemax
+        return (block, block, size // block, free, free, 0, 0, 0, 0, 255)
+    return statvfs
+
+
+def attach_usb(board):
+    master, slave = os.openpty()
+    tty.setraw(slave)  # a CDC port passes bytes through untouched
+    board.usb_port = os.ttyname(slave)
+    sys.stdin = io.TextIOWrapper(io.BufferedReader(io.FileIO(master, 'rb', closefd=False)))
+    sys.stdout = io.TextIOWrapper(io.BufferedWriter(io.FileIO(master, 'wb', closefd=False)),
+                                  line_buffering=True)
+
+
+def wait_ready(port=4242, host='127.0.0.1', timeout=30):
+    """Block until the firmware accepts connections on ``port``."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError('firmware not listening on port %d' % port)
+            time.sleep(0.1)
+
+
+def add_board_arguments(parser):
+    """Command-line options for the Board settings worth tuning per run."""
+    parser.add_argument('--jpeg', help='JPEG served for full-size captures')
+    parser.add_argument('--preview-jpeg', help='JPEG served for QVGA preview frames')
+    parser.add_argument('--spi-max-hz', type=int, default=8_000_000,
+                        help='fastest reliable ArduChip SPI clock')
+    parser.add_argument('--i2c-max-hz', type=int, default=400_000,
+                        help='fastest OV5642 SCCB clock')
+    parser.add_argument('--link-mbps', type=float, default=12.0,
+                        help='shared Wi-Fi throughput, 0 for unthrottled')
+    parser.add_argument('--usb', action='store_true',
+                        help='boot on USB power with the CDC port on a pseudo-terminal')
+    parser.add_argument('--seed', type=int, help='seed for capture timing and synthetic frames')
+    parser.add_argument('--firmware', default=FIRMWARE, help='directory holding main.py')
+    parser.add_argument('--flash', help='directory standing in for the Pico filesystem')
+    parser.add_argument('--flash-kb', type=int,
+                        help='filesystem size the firmware sees (default: the host disk)')
+
+
+def make_board(args):
+    return _board.Board(jpeg=args.jpeg, preview_jpeg=args.preview_jpeg,
+                        spi_max_hz=args.spi_max_hz, i2c_max_hz=args.i2c_max_hz,
+                        link_bps=int(args.link_mbps * 1e6), usb=args.usb,
+                        flash_bytes=args.flash_kb and args.flash_kb * 1024, seed=args.seed)
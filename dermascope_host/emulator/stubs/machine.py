@@ -0,0 +1,186 @@
+"""Fake MicroPython ``machine`` module (rp2 port) backed by the emulated board."""
+import errno
+import time
+
+from dermascope_host.emulator import board as _board
+
+
+def _b():
+    return _board.current
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self.handler = None
+        self.trigger = 0
+        if pull == Pin.PULL_UP:
+            _b().levels.setdefault(id, 1)
+        _b().attach(self)
+        if value is not None:
+            self.value(value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        self.__init__(self.id, mode, pull, value)
+
+    def value(self, v=None):
+        if v is None:
+            return _b().level(self.id)
+        _b().output(self.id, 1 if v else 0)
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def high(self):
+        self.value(1)
+
+    def low(self):
+        self.value(0)
+
+    def toggle(self):
+        self.value(1 - self.value())
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self.handler = handler
+        self.trigger = trigger if handler else 0
+
+    def _edge(self, level):
+        # Called by the board from whichever thread changed the level
+        if self.handler and self.trigger & (Pin.IRQ_RISING if level else Pin.IRQ_FALLING):
+            self.handler(self)
+
+    def __repr__(self):
+        return 'Pin(%s)' % (self.id,)
+
+
+class SPI:
+    MSB = 0
+    LSB = 1
+
+    def __init__(self, id, baudrate=1000000, polarity=0, phase=0, bits=8,
+                 firstbit=MSB, sck=None, mosi=None, miso=None):
+        self.id = id
+        self.init(baudrate, polarity, phase)
+
+    def init(self, baudrate=1000000, polarity=0, phase=0, **kw):
+        self.baudrate = _b().spi_baud(baudrate)
+        self.polarity = polarity
+        self.phase = phase
+
+    def deinit(self):
+        pass
+
+    def write(self, buf):
+        _b().spi_write(bytes(buf), self.baudrate)
+
+    def read(self, nbytes, write=0):
+        buf = bytearray(nbytes)
+        self.readinto(buf, write)
+        return bytes(buf)
+
+    def readinto(self, buf, write=0):
+        _b().spi_readinto(memoryview(buf).cast('B'), self.baudrate)
+
+    def write_readinto(self, write_buf, read_buf):
+        _b().spi_write(bytes(write_buf), self.baudrate)
+        _b().spi_readinto(memoryview(read_buf).cast('B'), self.baudrate)
+
+    def __repr__(self):
+        return 'SPI(%d, baudrate=%d, polarity=%d, phase=%d, bits=8)' % (
+            self.id, self.baudrate, self.polarity, self.phase)
+
+
+class I2C:
+    def __init__(self, id, scl=None, sda=None, freq=400000, timeout=50000):
+        self.id = id
+        self.freq = freq
+
+    def scan(self):
+        return [_board.SENSOR_ADDR]
+
+    def writeto(self, addr, buf, stop=True):
+        _b().i2c_write(addr, bytes(buf), self.freq)
+        return len(buf)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        return _b().i2c_read(addr, nbytes, self.freq)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        buf[:] = _b().i2c_read(addr, len(buf), self.freq)
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        if addrsize != 16:
+            raise OSError(errno.EIO)
+        self.writeto(addr, memaddr.to_bytes(2, 'big') + bytes(buf))
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        if addrsize != 16:
+            raise OSError(errno.EIO)
+        self.writeto(addr, memaddr.to_bytes(2, 'big'))
+        return self.readfrom(addr, nbytes)
+
+
+PWRON_RESET = 1
+WDT_RESET = 3
+
+
+def freq(hz=None):
+    return 125_000_000
+
+
+def unique_id():
+    return b'\xe6\x61\x41\x04\x03\x2a\x7c\x2d'
+
+
+def reset_cause():
+    return PWRON_RESET
+
+
+def reset():
+    raise SystemExit('machine.reset()')
+
+
+soft_reset = reset
+
+
+def idle():
+    time.sleep(0)
+
+
+def lightsleep(time_ms=None):
+    # The whole chip stops, so the caller's event loop stalls for the duration
+    board = _b()
+    board.sleep_ms += time_ms or 0
+    if board.clock.enabled:
+        time.sleep((time_ms or 0) / 1000)
+
+
+def deepsleep(time_ms=None):
+    lightsleep(time_ms)
+    reset()
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
+
+
+def time_pulse_us(pin, pulse_level, timeout_us=1000000):
+    return -2
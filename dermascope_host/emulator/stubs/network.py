@@ -0,0 +1,68 @@
+"""Fake MicroPython ``network`` module: a CYW43 interface on the loopback."""
+import time
+
+from dermascope_host.emulator import board as _board
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = -3
+STAT_NO_AP_FOUND = -2
+STAT_CONNECT_FAIL = -1
+STAT_GOT_IP = 3
+
+
+class WLAN:
+    def __init__(self, interface_id=STA_IF):
+        self.interface = interface_id
+        self._active = False
+        self._config = {'essid': 'PICO%d' % interface_id, 'channel': 3,
+                        'mac': b'\x28\xcd\xc1\x00\x00' + bytes([interface_id])}
+        self._connect_at = None
+        self._up_at = 0.0
+
+    def active(self, is_active=None):
+        # The CYW43 takes a while to come up after activation
+        if is_active is None:
+            return self._active and time.monotonic() >= self._up_at
+        self._active = bool(is_active)
+        if self._active:
+            self._up_at = time.monotonic() + _board.current.ap_up_ms / 1000
+        else:
+            self._connect_at = None
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config[args[0]]
+        self._config.update(kwargs)
+
+    def connect(self, ssid=None, key=None, **kwargs):
+        # Association takes as long as the board says a real AP would
+        self._config['ssid'] = ssid
+        self._connect_at = time.monotonic() + _board.current.wifi_connect_ms / 1000
+
+    def disconnect(self):
+        self._connect_at = None
+
+    def status(self, param=None):
+        if param == 'rssi':
+            return -50
+        if not self._active:
+            return STAT_IDLE
+        if self.interface == AP_IF or self.isconnected():
+            return STAT_GOT_IP
+        return STAT_CONNECTING if self._connect_at else STAT_IDLE
+
+    def isconnected(self):
+        if self.interface == AP_IF:
+            return self._active
+        return (self._active and self._connect_at is not None
+                and time.monotonic() >= self._connect_at)
+
+    def ifconfig(self, config=None):
+        return ('127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1')
+
+    def scan(self):
+        return []
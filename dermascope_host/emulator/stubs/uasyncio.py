@@ -0,0 +1,160 @@
+"""Fake ``uasyncio`` on top of CPython's asyncio.
+
+Adds the MicroPython-only names (``sleep_ms``, ``wait_for_ms``,
+``ThreadSafeFlag``) and makes ``start_server`` behave like the Pico W's
+network stack: lwIP's small send buffer per socket and one radio shared by
+every connection. ``StreamReader``/``StreamWriter`` take MicroPython's
+``(stream, extra)`` arguments so the firmware can wrap its USB stdio.
+"""
+import asyncio as _asyncio
+import socket as _socket
+import threading as _threading
+import time as _time
+from asyncio import *  # noqa: F401,F403
+
+from dermascope_host.emulator import board as _board
+
+
+async def sleep_ms(ms):
+    await _asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(aw, timeout):
+    return await _asyncio.wait_for(aw, timeout / 1000)
+
+
+class ThreadSafeFlag:
+    # Set from a pin IRQ, i.e. from whichever thread drives the board's GPIO
+    def __init__(self):
+        self._loop = None
+        self._event = None
+        self._pending = False
+
+    def set(self):
+        if self._loop is None:
+            self._pending = True
+        else:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    def clear(self):
+        self._pending = False
+        if self._event is not None:
+            self._event.clear()
+
+    async def wait(self):
+        if self._loop is None:
+            self._loop = _asyncio.get_running_loop()
+            self._event = _asyncio.Event()
+            if self._pending:
+                self._event.set()
+        await self._event.wait()
+        self._event.clear()
+
+
+class _Link:
+    # Paces drains so everything on one link together moves at most the
+    # board's `attr` bits per second
+    def __init__(self, attr):
+        self.attr = attr
+        self.due = 0.0
+
+    async def send(self, nbytes):
+        bps = getattr(_board.current, self.attr)
+        if not bps:
+            return
+        now = _time.monotonic()
+        self.due = max(self.due, now) + nbytes * 8 / bps
+        if self.due > now:
+            await _asyncio.sleep(self.due - now)
+
+
+_radio = _Link('link_bps')
+_usb = _Link('usb_bps')
+
+
+class _StreamWriter:
+    def __init__(self, writer):
+        self._writer = writer
+        self._pending = 0
+
+    def write(self, buf):
+        self._pending += len(buf)
+        self._writer.write(bytes(buf))  # MicroPython copies too
+
+    async def drain(self):
+        n, self._pending = self._pending, 0
+        await _radio.send(n)
+        await self._writer.drain()
+
+    def __getattr__(self, name):
+        return getattr(self._writer, name)
+
+
+async def start_server(callback, host, port, backlog=5):
+    async def accept(reader, writer):
+        await callback(reader, _StreamWriter(writer))
+
+    server = await _asyncio.start_server(accept, host, port, backlog=backlog,
+                                         reuse_address=True)
+    for sock in server.sockets:
+        # Accepted sockets inherit the listener's buffer size
+        sock.setsockopt(_socket.SOL_SOCKET, _socket.SO_SNDBUF, _board.current.tcp_sndbuf)
+    return server
+
+
+async def _in_thread(fn, *args):
+    # Blocking file I/O off the event loop, in a daemon thread so a read that
+    # never returns doesn't hold up interpreter exit
+    loop = _asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def run():
+        try:
+            result = fn(*args)
+        except Exception as e:
+            loop.call_soon_threadsafe(future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(future.set_result, result)
+
+    _threading.Thread(target=run, daemon=True).start()
+    return await future
+
+
+class Stream:
+    # MicroPython's Stream(s, e={}) over a blocking file object: the USB CDC
+    # stdio buffers, paced at the board's usb_bps
+    def __init__(self, s, e={}):
+        self.s = s
+        self.e = e
+        self.out = b''
+
+    def get_extra_info(self, v):
+        return self.e[v]
+
+    async def read(self, n=-1):
+        return await _in_thread(self.s.read, n)
+
+    async def readline(self):
+        return await _in_thread(self.s.readline)
+
+    def write(self, buf):
+        self.out += bytes(buf)
+
+    async def drain(self):
+        data, self.out = self.out, b''
+        await _usb.send(len(data))
+        await _in_thread(self._write, data)
+
+    def _write(self, data):
+        self.s.write(data)
+        self.s.flush()
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+StreamReader = Stream
+StreamWriter = Stream
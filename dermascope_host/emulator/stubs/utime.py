@@ -0,0 +1,58 @@
+"""Fake MicroPython ``utime``: ticks wrap at 2**30 like the real port."""
+import time as _time
+
+TICKS_PERIOD = 1 << 30
+_TICKS_HALF = TICKS_PERIOD // 2
+_t0 = _time.monotonic_ns()
+
+
+def ticks_ms():
+    return ((_time.monotonic_ns() - _t0) // 1_000_000) % TICKS_PERIOD
+
+
+def ticks_us():
+    return ((_time.monotonic_ns() - _t0) // 1_000) % TICKS_PERIOD
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) % TICKS_PERIOD
+
+
+def ticks_diff(ticks1, ticks2):
+    return (ticks1 - ticks2 + _TICKS_HALF) % TICKS_PERIOD - _TICKS_HALF
+
+
+def sleep(seconds):
+    _time.sleep(seconds)
+
+
+def sleep_ms(ms):
+    _time.sleep(ms / 1000)
+
+
+def sleep_us(us):
+    _time.sleep(us / 1_000_000)
+
+
+def time():
+    return int(_time.time())
+
+
+def time_ns():
+    return _time.time_ns()
+
+
+def localtime(secs=None):
+    return _time.localtime(secs)[:8]
+
+
+def gmtime(secs=None):
+    return _time.gmtime(secs)[:8]
+
+
+def mktime(t):
+    return int(_time.mktime(tuple(t[:8]) + (-1,)))
@@ -0,0 +1,287 @@
+"""Regression tests that run DermaScope/main.py on the emulator.
+
+Each test boots the firmware in its own process (the fake modules and the
+firmware's ports are process-wide) with ``realtime=False``, so bus and
+exposure time are accounted but not slept, and talks to it over localhost
+like a host would::
+
+    python -m pytest dermascope_host/emulator/test_firmware.py
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from dermascope_host import wire
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     os.pardir, os.pardir))
+PORT = 4242
+MJPEG_PORT = 8080
+SMALL_FRAMES = 0.02  # bytes per pixel: ~100 KB full frames keep the tests quick
+
+RUNNER = '''
+import json, sys
+from dermascope_host.emulator import Board, run_firmware
+board = Board(**json.loads(sys.argv[1]))
+run_firmware(board, flash=sys.argv[2])
+for line in sys.stdin:
+    if line.strip() == 'press':
+        board.press(hold_ms=250)
+'''
+
+
+def recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        data = sock.recv(n - len(buf))
+        if not data:
+            raise ConnectionError('device closed the connection')
+        buf += data
+    return buf
+
+
+def read_message(sock):
+    """(header dict, meta, payload) of the next wire-format message."""
+    return read_body(sock, wire.unpack_header(recv_exact(sock, wire.HEADER.size)))
+
+
+def read_body(sock, header):
+    meta = json.loads(bytes(recv_exact(sock, header['meta_len']))) if header['meta_len'] else {}
+    payload = bytearray()
+    while True:
+        size, crc = wire.CHUNK.unpack(recv_exact(sock, wire.CHUNK.size))
+        if not size:
+            assert crc == len(payload)
+            return header, meta, payload
+        data = recv_exact(sock, size)
+        assert wire.crc32(data) == crc
+        payload += data
+
+
+def read_frames(sock, count, timeout=15):
+    frames = []
+    sock.settimeout(timeout)
+    while len(frames) < count:
+        header, meta, payload = read_message(sock)
+        if header['kind'] == wire.KIND_FRAME:
+            frames.append((header, meta, payload))
+    return frames
+
+
+def command(sock, line):
+    """Send a command line and return its reply, skipping frames."""
+    sock.sendall(line.encode() + b'\n')
+    sock.settimeout(10)
+    while True:
+        header, meta, _ = read_message(sock)
+        if header['kind'] == wire.KIND_MSG and meta.get('cmd') == line.split()[0].lower():
+            return meta
+
+
+def port_open(port):
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+        return True
+    except OSError:
+        return False
+
+
+class Device:
+    """The firmware running in a child process on a flash directory."""
+
+    def __init__(self, tmp_path, **board):
+        assert not port_open(PORT), 'something is already listening on port %d' % PORT
+        board.setdefault('realtime', False)
+        board.setdefault('bytes_per_pixel', SMALL_FRAMES)
+        board.setdefault('seed', 1)
+        self.flash = tmp_path / 'flash'
+        self.flash.mkdir(exist_ok=True)
+        self.log_path = tmp_path / 'firmware.log'
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        with open(self.log_path, 'wb') as log:
+            self.proc = subprocess.Popen(
+                [sys.executable, '-u', '-c', RUNNER, json.dumps(board), str(self.flash)],
+                stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT, env=env)
+
+    def connect(self, port=PORT, timeout=30):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return socket.create_connection(('127.0.0.1', port), timeout=1)
+            except OSError:
+                assert self.proc.poll() is None, self.log()
+                assert time.monotonic() < deadline, 'firmware not listening'
+                time.sleep(0.02)
+
+    def viewer(self):
+        """An MJPEG viewer; returns (socket, bytearray filling in the background)."""
+        sock = self.connect(MJPEG_PORT)
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: dermascope\r\n\r\n')
+        data = bytearray()
+
+        def read():
+            try:
+                while True:
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        return
+                    data.extend(chunk)
+            except OSError:
+                pass
+        threading.Thread(target=read, daemon=True).start()
+        return sock, data
+
+    def press(self):
+        self.proc.stdin.write(b'press\n')
+        self.proc.stdin.flush()
+
+    def log(self):
+        return self.log_path.read_text(errors='replace')
+
+    def wait_log(self, text, timeout=10):
+        deadline = time.monotonic() + timeout
+        while text not in self.log():
+            assert time.monotonic() < deadline, 'no %r in the log:\n%s' % (text, self.log())
+            time.sleep(0.05)
+
+    def queue(self):
+        return sorted(os.listdir(self.flash / 'queue'))
+
+    def stop(self):
+        self.proc.kill()
+        self.proc.wait()
+        while port_open(PORT) or port_open(MJPEG_PORT):
+            time.sleep(0.05)
+
+
+@pytest.fixture
+def device(tmp_path):
+    started = []
+
+    def start(**board):
+        started.append(Device(tmp_path, **board))
+        return started[-1]
+    yield start
+    for dev in started:
+        dev.stop()
+
+
+def test_slow_client_gets_every_queued_capture(device):
+    # user-003: staging used to skip full captures a slow client hadn't started
+    dev = device(link_bps=1_000_000)
+    sock = dev.connect()
+    sock.sendall(b'CAPTURE 4\n')
+    ids = [header['frame_id'] for header, _, _ in read_frames(sock, 4, timeout=20)]
+    assert ids == sorted(ids) and len(set(ids)) == 4
+    assert 'skipping' not in dev.log()
+
+
+def test_burst_sends_at_most_one_frame_per_slot(device):
+    # user-014: a burst's later frames used to lose their slot to earlier ones
+    dev = device(link_bps=1_000_000)
+    sock = dev.connect()
+    assert command(sock, 'BURST 4 3')['burst'] == [4, 2]
+    sock.sendall(b'CAPTURE 1\n')
+    ranks = sorted(meta['burst']['rank'] for _, meta, _ in read_frames(sock, 2, timeout=20))
+    assert ranks == [0, 1]
+
+
+def test_direct_stream_stays_off_the_mjpeg_stream(device):
+    # user-007: frames too big to stage went to MJPEG viewers as wire format
+    dev = device(flash_bytes=64 * 1024, bytes_per_pixel=0.12)
+    viewer, data = dev.viewer()
+    sock = dev.connect()
+    sock.sendall(b'CAPTURE 1\n')
+    header, _, payload = read_frames(sock, 1)[0]
+    while header['mode'] != wire.MODE_CAPTURE:  # the viewer's previews reach us too
+        header, _, payload = read_frames(sock, 1)[0]
+    assert header['flags'] & wire.FLAG_LEN_MAX
+    assert payload[:2] == b'\xff\xd8' and payload[-2:] == b'\xff\xd9'
+    time.sleep(0.5)
+    viewer.close()
+    assert data.count(b'--frame') > 1
+    assert b'DSCP' not in data
+
+
+def test_preview_resumes_after_reconnect(device):
+    # user-007: PREVIEW ON outlived the session but nothing woke the capture loop
+    dev = device()
+    sock = dev.connect()
+    sock.sendall(b'PREVIEW ON\n')
+    read_frames(sock, 5)
+    sock.close()
+    time.sleep(0.5)
+    sock = dev.connect()
+    assert command(sock, 'STATUS')['preview']
+    assert len(read_frames(sock, 5, timeout=5)) == 5
+
+
+def test_dropped_client_frame_is_renamed_into_a_tight_queue(device):
+    # user-019: spooling asked for the frame's size in free flash even to rename
+    dev = device(flash_bytes=200 * 1024, link_bps=200_000)
+    sock = dev.connect()
+    sock.sendall(b'CAPTURE 1\n')
+    sock.settimeout(10)
+    while True:
+        header = wire.unpack_header(recv_exact(sock, wire.HEADER.size))
+        if header['kind'] == wire.KIND_FRAME:
+            break
+        read_body(sock, header)
+    sock.close()  # mid-frame
+    dev.wait_log('queued, 1 waiting')
+    assert dev.queue() == ['000001.hdr', '000001.jpg']
+    assert not (dev.flash / 'stage0.jpg').exists()
+
+
+def test_offline_capture_reclaims_an_idle_stage_file(device):
+    # user-019: a delivered frame's stage file blocked every later offline capture
+    dev = device(flash_bytes=200 * 1024)
+    sock = dev.connect()
+    sock.sendall(b'CAPTURE 1\n')
+    first = read_frames(sock, 1)[0][0]['frame_id']
+    time.sleep(0.5)  # let the device see the frame through before we go
+    sock.close()
+    dev.wait_log('Client disconnected')
+    assert (dev.flash / 'stage0.jpg').exists()
+    dev.press()
+    dev.wait_log('queued, 1 waiting')
+    with open(dev.flash / 'queue' / '000001.hdr', 'rb') as f:
+        assert wire.unpack_header(f.read())['frame_id'] == first + 1
+    assert not (dev.flash / 'stage0.jpg').exists()
+
+
+def test_preview_frames_are_not_queued(device):
+    # user-019: the last preview frame was queued when the final viewer left
+    dev = device()
+    for i in range(5):
+        viewer, _ = dev.viewer()
+        time.sleep(0.2 + 0.05 * i)
+        viewer.close()
+    time.sleep(1)
+    assert dev.queue() == []
+
+
+def test_backlog_reaches_a_client_connected_during_boot(device, tmp_path):
+    # user-020: the backlog was loaded after bring-up without offering it to
+    # clients that were already connected. Real time with slow I2C keeps the
+    # camera coming up long enough for the client to get in first.
+    queue = tmp_path / 'flash' / 'queue'
+    queue.mkdir(parents=True)
+    payload = b'\xff\xd8' + b'\x55' * 5000 + b'\xff\xd9'
+    meta = json.dumps({'queued': True}).encode()
+    (queue / '000001.jpg').write_bytes(payload)
+    (queue / '000001.hdr').write_bytes(
+        wire.HEADER.pack(wire.MAGIC, wire.VERSION, wire.KIND_FRAME, 0, 7, 1234,
+                         wire.MODE_CAPTURE, 0, len(payload), 0, 1024, len(meta)) + meta)
+    dev = device(realtime=True, ap_up_ms=0, i2c_max_hz=20_000)
+    sock = dev.connect()
+    header, meta, received = read_frames(sock, 1, timeout=10)[0]
+    log = dev.log()
+    assert log.index('Client connected') < log.index('frames queued on flash')
+    assert header['frame_id'] == 7 and meta['queued'] and received == payload
@@ -0,0 +1,41 @@
+"""Host-side constants for the DermaScope wire format, version 1.
+
+DermaScope/framing.py is the source of truth (it runs on the device and
+documents the layout); this mirrors what a receiver needs, so host tools do
+not have to put the firmware directory on ``sys.path``.
+"""
+import struct
+import zlib
+
+MAGIC = b'DSCP'
+VERSION = 1
+HEADER = struct.Struct('>4sBBHIIBBIIHH')
+CHUNK = struct.Struct('>HI')
+
+KIND_FRAME = 1
+KIND_MSG = 2
+
+FLAG_RESUMED = 0x01
+FLAG_LEN_MAX = 0x02
+
+MODE_CAPTURE = 0
+MODE_PREVIEW = 1
+MODE_ROI = 2
+MODE_NAMES = {MODE_CAPTURE: 'capture', MODE_PREVIEW: 'preview', MODE_ROI: 'roi'}
+
+crc32 = zlib.crc32
+
+
+class ProtocolError(ValueError):
+    """The byte stream is not valid wire format: resynchronise by reconnecting."""
+
+
+def unpack_header(buf):
+    """Header fields of one message as a dict; raises ProtocolError if invalid."""
+    (magic, version, kind, flags, frame_id, timestamp_ms, mode, _,
+     payload_len, offset, chunk_size, meta_len) = HEADER.unpack_from(buf)
+    if magic != MAGIC or version != VERSION:
+        raise ProtocolError('bad header %r v%d' % (magic, version))
+    return {'kind': kind, 'flags': flags, 'frame_id': frame_id,
+            'timestamp_ms': timestamp_ms, 'mode': mode, 'payload_len': payload_len,
+            'offset': offset, 'chunk_size': chunk_size, 'meta_len': meta_len}